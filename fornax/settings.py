@@ -131,10 +131,36 @@ REST_FRAMEWORK = {
 SRC_DIR = os.path.join(config.STORAGE_ROOT, config.STORAGE_SRC_DIR)
 TMP_DIR = os.path.join(config.STORAGE_ROOT, config.STORAGE_TMP_DIR)
 DEST_DIR = os.path.join(config.STORAGE_ROOT, config.STORAGE_DEST_DIR)
+CACHE_DIR = os.path.join(config.STORAGE_ROOT, config.STORAGE_CACHE_DIR)
 
 CLEANUP_URL = config.CLEANUP_URL
+CLEANUP_BATCH_SIZE = config.CLEANUP_BATCH_SIZE
+CLEANUP_REQUEST_TIMEOUT = config.CLEANUP_REQUEST_TIMEOUT
+CLEANUP_REQUEST_RETRIES = config.CLEANUP_REQUEST_RETRIES
+CLEANUP_RETRY_BACKOFF = config.CLEANUP_RETRY_BACKOFF
+CLEANUP_SWEEP_STATUS = config.CLEANUP_SWEEP_STATUS
+CLEANUP_SWEEP_MIN_AGE = config.CLEANUP_SWEEP_MIN_AGE
+
+ROUTINE_CONCURRENCY = {
+    "extract": config.ROUTINE_CONCURRENCY_EXTRACT,
+    "restructure": config.ROUTINE_CONCURRENCY_RESTRUCTURE,
+    "assemble": config.ROUTINE_CONCURRENCY_ASSEMBLE,
+    "start": config.ROUTINE_CONCURRENCY_START,
+    "cleanup": config.ROUTINE_CONCURRENCY_CLEANUP,
+}
+
+STREAMING_EXTRACTION = config.STREAMING_EXTRACTION
+CHECKSUM_WORKERS = config.CHECKSUM_WORKERS
+COMPRESSION_THREADS = config.COMPRESSION_THREADS
+PROCESSING_CONFIG_TTL = config.PROCESSING_CONFIG_TTL
+REMOVE_COMPLETED_WORKERS = config.REMOVE_COMPLETED_WORKERS
 
 ARCHIVEMATICA_VERSION = config.AM_VERSION
+ARCHIVEMATICA_REQUEST_TIMEOUT = config.AM_REQUEST_TIMEOUT
+ARCHIVEMATICA_REQUEST_RETRIES = config.AM_REQUEST_RETRIES
+ARCHIVEMATICA_RETRY_BACKOFF = config.AM_RETRY_BACKOFF
+ARCHIVEMATICA_POOL_SIZE = config.AM_POOL_SIZE
+ARCHIVEMATICA_STATUS_MAX_AGE = config.AM_STATUS_MAX_AGE
 ARCHIVEMATICA_ORIGINS = {
     "aurora": {
         "baseurl": config.AM_PL_AURORA_BASEURL,
@@ -143,6 +169,13 @@ ARCHIVEMATICA_ORIGINS = {
         "location_uuid": config.AM_PL_AURORA_LOCATION_UUID,
         "processing_config": config.AM_PL_AURORA_PROCESSING_CONFIG,
         "close_completed": config.AM_PL_AURORA_CLOSE_COMPLETED,
+        "max_concurrent_sips": config.AM_PL_AURORA_MAX_CONCURRENT_SIPS,
+        "package_format": config.AM_PL_AURORA_PACKAGE_FORMAT,
+        "compression_level": config.AM_PL_AURORA_COMPRESSION_LEVEL,
+        "streaming_assembly": config.AM_PL_AURORA_STREAMING_ASSEMBLY,
+        "remote_csv_validation": config.AM_PL_AURORA_REMOTE_CSV_VALIDATION,
+        "status_interval": config.AM_PL_AURORA_STATUS_INTERVAL,
+        "max_concurrent_transfers": config.AM_PL_AURORA_MAX_CONCURRENT_TRANSFERS,
     },
     "digitization": {
         "baseurl": config.AM_PL_DIGITIZATION_BASEURL,
@@ -151,6 +184,13 @@ ARCHIVEMATICA_ORIGINS = {
         "location_uuid": config.AM_PL_DIGITIZATION_LOCATION_UUID,
         "processing_config": config.AM_PL_DIGITIZATION_PROCESSING_CONFIG,
         "close_completed": config.AM_PL_DIGITIZATION_CLOSE_COMPLETED,
+        "max_concurrent_sips": config.AM_PL_DIGITIZATION_MAX_CONCURRENT_SIPS,
+        "package_format": config.AM_PL_DIGITIZATION_PACKAGE_FORMAT,
+        "compression_level": config.AM_PL_DIGITIZATION_COMPRESSION_LEVEL,
+        "streaming_assembly": config.AM_PL_DIGITIZATION_STREAMING_ASSEMBLY,
+        "remote_csv_validation": config.AM_PL_DIGITIZATION_REMOTE_CSV_VALIDATION,
+        "status_interval": config.AM_PL_DIGITIZATION_STATUS_INTERVAL,
+        "max_concurrent_transfers": config.AM_PL_DIGITIZATION_MAX_CONCURRENT_TRANSFERS,
     },
     "av_digitization": {
         "baseurl": config.AM_PL_AV_DIGITIZATION_BASEURL,
@@ -159,6 +199,13 @@ ARCHIVEMATICA_ORIGINS = {
         "location_uuid": config.AM_PL_AV_DIGITIZATION_LOCATION_UUID,
         "processing_config": config.AM_PL_AV_DIGITIZATION_PROCESSING_CONFIG,
         "close_completed": config.AM_PL_AV_DIGITIZATION_CLOSE_COMPLETED,
+        "max_concurrent_sips": config.AM_PL_AV_DIGITIZATION_MAX_CONCURRENT_SIPS,
+        "package_format": config.AM_PL_AV_DIGITIZATION_PACKAGE_FORMAT,
+        "compression_level": config.AM_PL_AV_DIGITIZATION_COMPRESSION_LEVEL,
+        "streaming_assembly": config.AM_PL_AV_DIGITIZATION_STREAMING_ASSEMBLY,
+        "remote_csv_validation": config.AM_PL_AV_DIGITIZATION_REMOTE_CSV_VALIDATION,
+        "status_interval": config.AM_PL_AV_DIGITIZATION_STATUS_INTERVAL,
+        "max_concurrent_transfers": config.AM_PL_AV_DIGITIZATION_MAX_CONCURRENT_TRANSFERS,
     },
     "legacy_digital": {
         "baseurl": config.AM_PL_LEGACY_DIGITAL_BASEURL,
@@ -167,6 +214,13 @@ ARCHIVEMATICA_ORIGINS = {
         "location_uuid": config.AM_PL_LEGACY_DIGITAL_LOCATION_UUID,
         "processing_config": config.AM_PL_LEGACY_DIGITAL_PROCESSING_CONFIG,
         "close_completed": config.AM_PL_LEGACY_DIGITAL_CLOSE_COMPLETED,
+        "max_concurrent_sips": config.AM_PL_LEGACY_DIGITAL_MAX_CONCURRENT_SIPS,
+        "package_format": config.AM_PL_LEGACY_DIGITAL_PACKAGE_FORMAT,
+        "compression_level": config.AM_PL_LEGACY_DIGITAL_COMPRESSION_LEVEL,
+        "streaming_assembly": config.AM_PL_LEGACY_DIGITAL_STREAMING_ASSEMBLY,
+        "remote_csv_validation": config.AM_PL_LEGACY_DIGITAL_REMOTE_CSV_VALIDATION,
+        "status_interval": config.AM_PL_LEGACY_DIGITAL_STATUS_INTERVAL,
+        "max_concurrent_transfers": config.AM_PL_LEGACY_DIGITAL_MAX_CONCURRENT_TRANSFERS,
     }
 }
 
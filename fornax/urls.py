@@ -18,11 +18,12 @@ from django.urls import include, re_path
 from rest_framework import routers
 
 from sip_assembly.views import (AssemblePackageView, CleanupPackageRequestView,
-                                CleanupPackageRoutineView, ExtractPackageView,
+                                CleanupPackageRoutineView, CleanupSweepView,
+                                ExtractPackageView, ProcessingConfigCacheView,
                                 RemoveCompletedIngestsView,
                                 RemoveCompletedTransfersView,
                                 RestructurePackageView, SIPViewSet,
-                                StartPackageView)
+                                StartPackageView, StreamAssemblePackageView)
 
 router = routers.DefaultRouter()
 router.register(r'sips', SIPViewSet)
@@ -32,6 +33,7 @@ urlpatterns = [
     re_path(r'^extract/', ExtractPackageView.as_view(), name="extract-sip"),
     re_path(r'^restructure/', RestructurePackageView.as_view(), name="restructure-sip"),
     re_path(r'^assemble/', AssemblePackageView.as_view(), name="assemble-sip"),
+    re_path(r'^stream-assemble/', StreamAssemblePackageView.as_view(), name="stream-assemble-sip"),
     re_path(r'^start/', StartPackageView.as_view(), name="start-sip"),
     re_path(r'^remove-transfers/',
             RemoveCompletedTransfersView.as_view(),
@@ -39,9 +41,13 @@ urlpatterns = [
     re_path(r'^remove-ingests/',
             RemoveCompletedIngestsView.as_view(),
             name="remove-ingests"),
+    re_path(r'^cleanup/sweep/', CleanupSweepView.as_view(), name="cleanup-sweep"),
     re_path(r'^cleanup/', CleanupPackageRoutineView.as_view(), name="cleanup-sip"),
     re_path(r'^request-cleanup/',
             CleanupPackageRequestView.as_view(),
             name="request-cleanup"),
+    re_path(r'^processing-configs/clear/',
+            ProcessingConfigCacheView.as_view(),
+            name="clear-processing-configs"),
     re_path(r'^status/', PingView.as_view(), name='ping'),
 ]
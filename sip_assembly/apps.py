@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class SipAssemblyConfig(AppConfig):
     name = 'sip_assembly'
+
+    def ready(self):
+        from sip_assembly import sessions
+        sessions.registry.install()
@@ -1,13 +1,21 @@
 import csv
-from os import makedirs, path, walk
+from io import StringIO
+from itertools import islice
+from os import makedirs, path, scandir
 
 from amclient.errors import error_lookup
 
+from .rights_validator import RightsCsvValidator
+
 
 class CsvCreator:
     """Creates and validates Archivematica-compliant CSV containing PREMIS rights"""
 
-    def __init__(self, am_version, client):
+    buffer_size = 1024 * 1024
+    chunk_size = 1000
+    sample_rows = 100
+
+    def __init__(self, am_version, client, remote_validation="all"):
         self.field_names = [
             'file', 'basis', 'status', 'determination_date', 'jurisdiction',
             'start_date', 'end_date', 'terms', 'citation', 'note', 'grant_act',
@@ -16,20 +24,14 @@ class CsvCreator:
         split_version = am_version.split(".")
         self.skip_no_act = True if (int(split_version[0]) <= 1 and int(split_version[1]) < 13) else False
         self.client = client
+        self.remote_validation = remote_validation
 
     def create_rights_csv(self, bag_path, rights_statements):
         self.bag_path = bag_path
         self.rights_statements = rights_statements
         self.csv_filepath = path.join(bag_path, 'data', 'metadata', 'rights.csv')
-        csvfile, csvwriter = self.setup_csv_file()
-        for (dirpath, dirnames, filenames) in walk(path.join(self.bag_path, 'data', 'objects')):
-            for file in filenames:
-                rights_rows = self.get_rights_rows(dirpath, file)
-                for rights_row in rights_rows:
-                    csvwriter.writerow(rights_row)
-        csvfile.close()
+        self.write_rights_rows(self.iter_object_paths(path.join(self.bag_path, 'data', 'objects')))
         self.validate_rights_csv()
-        csvfile.close()
         return "CSV {} created.".format(self.csv_filepath)
 
     def setup_csv_file(self):
@@ -44,33 +46,79 @@ class CsvCreator:
         if not path.isfile(self.csv_filepath):
             if not path.exists(path.dirname(self.csv_filepath)):
                 makedirs(path.dirname(self.csv_filepath))
-            csvfile = open(self.csv_filepath, 'w')
+            csvfile = open(self.csv_filepath, 'w', buffering=self.buffer_size)
             csvwriter = csv.writer(csvfile)
             csvwriter.writerow(self.field_names)
         else:
-            csvfile = open(self.csv_filepath, 'a')
+            csvfile = open(self.csv_filepath, 'a', buffering=self.buffer_size)
             csvwriter = csv.writer(csvfile)
         return csvfile, csvwriter
 
-    def get_rights_rows(self, dirpath, file):
-        """Gets rows (array of arrays) for each rights statement for a file."""
+    def create_rights_csv_from_paths(self, csv_filepath, file_paths, rights_statements):
+        """Creates and validates a rights CSV for bags which have not been extracted to disk.
+
+        Args:
+            csv_filepath (str): location at which to create the CSV.
+            file_paths (list): paths of files relative to the bag root.
+            rights_statements (list): rights statements to apply to each file.
+        """
+        self.rights_statements = rights_statements
+        self.csv_filepath = csv_filepath
+        self.write_rights_rows(file_paths)
+        self.validate_rights_csv()
+        return "CSV {} created.".format(self.csv_filepath)
 
+    def write_rights_rows(self, file_paths):
+        """Writes rows for each file path to the CSV in chunks.
+
+        Rights statements are the same for every file in a SIP, so the values
+        following the file path are calculated once and reused for each file.
+        """
+        row_tails = self.get_row_tails()
+        csvfile, csvwriter = self.setup_csv_file()
+        with csvfile:
+            chunk = []
+            for path_to_file in file_paths:
+                chunk.extend([path_to_file] + row_tail for row_tail in row_tails)
+                if len(chunk) >= self.chunk_size:
+                    csvwriter.writerows(chunk)
+                    chunk = []
+            csvwriter.writerows(chunk)
+
+    def iter_object_paths(self, directory):
+        """Yields paths relative to the bag root of all files in a directory tree."""
+        directories = [(directory, path.relpath(directory, self.bag_path))]
+        while directories:
+            dirpath, rel_dirpath = directories.pop()
+            with scandir(dirpath) as entries:
+                for entry in entries:
+                    rel_path = "{}/{}".format(rel_dirpath, entry.name)
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append((entry.path, rel_path))
+                    else:
+                        yield rel_path
+
+    def get_rights_rows(self, dirpath, file):
         """Gets rows (array of arrays) for each rights statement for a file."""
         path_to_file = path.join(dirpath.split(self.bag_path)[1], file).lstrip('/')
-        rights_rows = []
+        return self.get_rights_rows_for_path(path_to_file)
+
+    def get_rights_rows_for_path(self, path_to_file):
+        """Gets rows for each rights statement for a file path relative to the bag root."""
+        return [[path_to_file] + row_tail for row_tail in self.get_row_tails()]
+
+    def get_row_tails(self):
+        """Gets the values following the file path in each row for the current rights statements."""
+        row_tails = []
         for rights_statement in self.rights_statements:
-            rights_granted_rows = self.get_grant_restriction_rows(rights_statement['rights_granted'])
-            for rights_granted_row in rights_granted_rows:
+            basis_values = self.get_basis_fields(rights_statement)
+            for rights_granted_row in self.get_grant_restriction_rows(rights_statement['rights_granted']):
                 if self.skip_no_act is True and rights_granted_row == ['', '', '', '', '']:
-                    pass
-                else:
-                    rights_row = []
-                    rights_row.append(path_to_file)
-                    for basis_value in self.get_basis_fields(rights_statement):
-                        rights_row.append(basis_value)
-                    rights_row[10:10] = rights_granted_row
-                    rights_rows.append(rights_row)
-        return rights_rows
+                    continue
+                row_tail = list(basis_values)
+                row_tail[9:9] = rights_granted_row
+                row_tails.append(row_tail)
+        return row_tails
 
     def get_basis_fields(self, rights_statement):
         """
@@ -112,8 +160,25 @@ class CsvCreator:
         return rows
 
     def validate_rights_csv(self):
-        file_obj = open(self.csv_filepath, "r")
-        result = self.client.validate_csv("rights", file_obj)
+        """Validates the CSV locally, then with Archivematica if configured.
+
+        `remote_validation` is one of `all` (upload the whole CSV), `sample`
+        (upload the header and the rows for the first few files, which contain
+        every distinct set of rights values) or `none`.
+        """
+        with open(self.csv_filepath, "r") as csvfile:
+            RightsCsvValidator(self.skip_no_act).validate(csvfile)
+        if self.remote_validation == "none":
+            return
+        with open(self.csv_filepath, "r") as csvfile:
+            if self.remote_validation == "sample":
+                sample_size = max(self.sample_rows, len(self.get_row_tails())) + 1
+                sample = StringIO()
+                csv.writer(sample, lineterminator="\n").writerows(islice(csv.reader(csvfile), sample_size))
+                sample.seek(0)
+                result = self.client.validate_csv("rights", sample)
+            else:
+                result = self.client.validate_csv("rights", csvfile)
         if isinstance(result, int):
             message = getattr(result, "message", error_lookup(result))
             raise Exception("Error validating CSV: {}".format(message))
@@ -0,0 +1,89 @@
+import struct
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ParallelGzipWriter:
+    """Writes a gzip stream, compressing blocks of input in parallel.
+
+    Input is split into fixed-size blocks which are deflated independently by
+    a pool of threads (zlib releases the GIL while compressing). Each block is
+    primed with the end of the previous block as a dictionary and ended with a
+    sync flush, so the blocks join up into a single standard gzip member which
+    can be read by any gzip implementation.
+    """
+
+    block_size = 1024 * 1024
+    dictionary_size = 32 * 1024
+
+    def __init__(self, fileobj, threads=4, compresslevel=9):
+        self.fileobj = fileobj
+        self.compresslevel = compresslevel
+        self.executor = ThreadPoolExecutor(max_workers=max(threads, 1))
+        self.max_pending = max(threads, 1) * 2
+        self.pending = deque()
+        self.buffer = bytearray()
+        self.previous = b""
+        self.crc = 0
+        self.size = 0
+        self.closed = False
+        self.fileobj.write(struct.pack(
+            "<BBBBLBB", 0x1f, 0x8b, zlib.DEFLATED, 0, int(time.time()), 0, 3))
+
+    def compress_block(self, block, dictionary, last):
+        if dictionary:
+            compressor = zlib.compressobj(
+                self.compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=dictionary)
+        else:
+            compressor = zlib.compressobj(
+                self.compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return compressor.compress(block) + compressor.flush(
+            zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+    def submit_block(self, block, last=False):
+        self.crc = zlib.crc32(block, self.crc)
+        self.size += len(block)
+        self.pending.append(self.executor.submit(
+            self.compress_block, block, self.previous, last))
+        self.previous = block[-self.dictionary_size:]
+        while len(self.pending) > self.max_pending:
+            self.fileobj.write(self.pending.popleft().result())
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("write to closed file")
+        self.buffer.extend(data)
+        while len(self.buffer) >= self.block_size:
+            self.submit_block(bytes(self.buffer[:self.block_size]))
+            del self.buffer[:self.block_size]
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.submit_block(bytes(self.buffer), last=True)
+            self.buffer = bytearray()
+            while self.pending:
+                self.fileobj.write(self.pending.popleft().result())
+            self.fileobj.write(struct.pack("<LL", self.crc, self.size & 0xffffffff))
+        finally:
+            self.executor.shutdown(cancel_futures=True)
+
+    def abort(self):
+        """Discards pending blocks without writing the end of the stream."""
+        self.closed = True
+        self.pending.clear()
+        self.executor.shutdown(cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
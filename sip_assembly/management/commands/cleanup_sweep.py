@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from sip_assembly.routines import CleanupSweepRoutine
+
+
+class Command(BaseCommand):
+    """Removes packages for SIPs which have finished processing from the destination directory."""
+    help = "Removes finished packages from the destination directory and reports the space reclaimed."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--min-status", type=int,
+            help="Process status SIPs must have reached, 40 (approved) or 50 (cleaned up). Defaults to CLEANUP_SWEEP_STATUS.")
+        parser.add_argument(
+            "--min-age", type=float,
+            help="Seconds since SIPs were last modified. Defaults to CLEANUP_SWEEP_MIN_AGE.")
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="Report packages which would be removed without removing them.")
+
+    def handle(self, *args, **options):
+        message, removed = CleanupSweepRoutine(
+            min_status=options["min_status"],
+            min_age=options["min_age"],
+            dry_run=options["dry_run"]).run()
+        self.stdout.write(message)
+        for identifier in removed:
+            self.stdout.write(identifier)
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from sip_assembly.routines import ArchivematicaClientMixin
+
+
+class Command(BaseCommand):
+    """Manages cached Archivematica processing configurations."""
+    help = "Warms or clears the processing configuration cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "action", choices=["warm", "clear"],
+            help="Fetch uncached configurations for all origins, or remove cached configurations.")
+        parser.add_argument(
+            "--origin",
+            help="Only clear the configuration for this origin.")
+
+    def handle(self, *args, **options):
+        client = ArchivematicaClientMixin()
+        if options["action"] == "warm":
+            message, origins = client.warm_processing_configs()
+        else:
+            message, origins = client.invalidate_processing_configs(options["origin"])
+        self.stdout.write("{} {}".format(message, ", ".join(origins)).strip())
@@ -0,0 +1,101 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from sip_assembly.routines import (ArchivematicaClientMixin,
+                                   AssemblePackageRoutine,
+                                   CleanupPackageRequester,
+                                   ExtractPackageRoutine,
+                                   RestructurePackageRoutine,
+                                   StartPackageRoutine,
+                                   StreamAssemblePackageRoutine)
+
+
+class Command(BaseCommand):
+    """Runs all SIP assembly routines in a single long-running process.
+
+    Each SIP is passed directly to the next routine as soon as the previous
+    routine finishes with it. Processing configurations for all origins are
+    cached when the worker starts. When there is no work to do the worker
+    sleeps, doubling the interval up to `--max-sleep` seconds. SIGINT and
+    SIGTERM stop the worker once the SIP currently being processed is finished.
+    """
+    help = "Runs the SIP assembly pipeline until stopped."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--min-sleep", type=float, default=1,
+            help="Seconds to sleep after an idle pass through the pipeline.")
+        parser.add_argument(
+            "--max-sleep", type=float, default=60,
+            help="Maximum seconds to sleep between idle passes.")
+        parser.add_argument(
+            "--once", action="store_true",
+            help="Make a single pass through the pipeline and exit.")
+
+    def handle(self, *args, **options):
+        self.stopping = threading.Event()
+        for sig in [signal.SIGINT, signal.SIGTERM]:
+            signal.signal(sig, self.stop)
+        self.routines = [
+            ExtractPackageRoutine(),
+            RestructurePackageRoutine(),
+            AssemblePackageRoutine(),
+            StreamAssemblePackageRoutine(),
+            StartPackageRoutine(),
+            CleanupPackageRequester()]
+        message, _ = ArchivematicaClientMixin().warm_processing_configs()
+        self.stdout.write(message)
+        sleep = options["min_sleep"]
+        while not self.stopping.is_set():
+            close_old_connections()
+            processed = self.run_pipeline()
+            if options["once"]:
+                break
+            if processed:
+                sleep = options["min_sleep"]
+            else:
+                self.stopping.wait(sleep)
+                sleep = min(sleep * 2, options["max_sleep"])
+        self.stdout.write("Pipeline stopped.")
+
+    def stop(self, signum, frame):
+        self.stdout.write("Stopping pipeline after current SIP...")
+        self.stopping.set()
+
+    def run_pipeline(self):
+        """Makes one pass through all routines.
+
+        Returns:
+            processed (int): number of routine steps successfully completed.
+        """
+        processed = 0
+        for routine in self.routines:
+            if self.stopping.is_set():
+                break
+            sip = self.run_routine(routine)
+            while sip:
+                processed += 1
+                routine = self.get_next_routine(routine)
+                if not routine or self.stopping.is_set():
+                    break
+                sip = self.run_routine(routine, sip.pk)
+        return processed
+
+    def get_next_routine(self, routine):
+        """Returns the routine which processes SIPs completed by `routine`."""
+        return next((r for r in self.routines if r.start_status == routine.end_status), None)
+
+    def run_routine(self, routine, pk=None):
+        """Runs a single routine, returning the SIP if it was successfully processed."""
+        try:
+            message, sip, completed = routine.run_once(pk)
+        except Exception as e:
+            self.stderr.write("{}: {}".format(routine.__class__.__name__, e))
+            return None
+        if sip:
+            self.stdout.write("{}: {} {}".format(
+                routine.__class__.__name__, sip.bag_identifier, message))
+        return sip if completed else None
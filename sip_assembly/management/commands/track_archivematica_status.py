@@ -0,0 +1,57 @@
+import signal
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from fornax import settings
+from sip_assembly.routines import ArchivematicaStatusTracker
+
+
+class Command(BaseCommand):
+    """Records the status of transfers in Archivematica until stopped.
+
+    Each origin is checked on its own interval, set by `status_interval` in
+    ARCHIVEMATICA_ORIGINS. SIGINT and SIGTERM stop the tracker once the
+    current check is finished.
+    """
+    help = "Tracks the status of transfers started in Archivematica."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--origin", choices=list(settings.ARCHIVEMATICA_ORIGINS),
+            help="Only track transfers from this origin.")
+        parser.add_argument(
+            "--once", action="store_true",
+            help="Check each origin once and exit.")
+
+    def handle(self, *args, **options):
+        self.stopping = threading.Event()
+        for sig in [signal.SIGINT, signal.SIGTERM]:
+            signal.signal(sig, self.stop)
+        tracker = ArchivematicaStatusTracker()
+        origins = [options["origin"]] if options["origin"] else list(settings.ARCHIVEMATICA_ORIGINS)
+        next_checks = {origin: time.monotonic() for origin in origins}
+        while not self.stopping.is_set():
+            close_old_connections()
+            for origin in origins:
+                if next_checks[origin] <= time.monotonic():
+                    self.track(tracker, origin)
+                    next_checks[origin] = time.monotonic() + settings.ARCHIVEMATICA_ORIGINS[origin]["status_interval"]
+            if options["once"]:
+                break
+            self.stopping.wait(max(min(next_checks.values()) - time.monotonic(), 0))
+        self.stdout.write("Status tracker stopped.")
+
+    def stop(self, signum, frame):
+        self.stdout.write("Stopping status tracker...")
+        self.stopping.set()
+
+    def track(self, tracker, origin):
+        try:
+            message, updated = tracker.run(origin)
+        except Exception as e:
+            self.stderr.write("{}: {}".format(origin, e))
+            return
+        self.stdout.write("{}: {} {} transfers checked.".format(origin, message, len(updated)))
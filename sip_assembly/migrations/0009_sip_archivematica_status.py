@@ -0,0 +1,33 @@
+# Generated by Django 4.2.11 on 2026-10-18 14:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sip_assembly', '0008_sip_archivematica_uuid'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sip',
+            name='archivematica_status',
+            field=models.CharField(blank=True, max_length=50, null=True),
+        ),
+        migrations.AddField(
+            model_name='sip',
+            name='archivematica_started',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='sip',
+            name='archivematica_status_checked',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='sip',
+            name='archivematica_completed',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.11 on 2026-10-18 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sip_assembly', '0009_sip_archivematica_status'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sip',
+            index=models.Index(fields=['process_status', 'created'], name='sip_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sip',
+            index=models.Index(fields=['origin', 'process_status', 'last_modified'], name='sip_origin_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sip',
+            index=models.Index(fields=['archivematica_uuid'], name='sip_archivematica_uuid_idx'),
+        ),
+    ]
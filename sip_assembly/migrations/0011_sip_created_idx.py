@@ -0,0 +1,17 @@
+# Generated by Django 4.2.11 on 2026-10-18 17:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sip_assembly', '0010_sip_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sip',
+            index=models.Index(fields=['created', 'id'], name='sip_created_idx'),
+        ),
+    ]
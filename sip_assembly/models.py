@@ -31,3 +31,15 @@ class SIP(BasePackage):
     )
 
     archivematica_uuid = models.CharField(max_length=255, null=True, blank=True)
+    archivematica_status = models.CharField(max_length=50, null=True, blank=True)
+    archivematica_started = models.DateTimeField(null=True, blank=True)
+    archivematica_status_checked = models.DateTimeField(null=True, blank=True)
+    archivematica_completed = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["process_status", "created"], name="sip_status_created_idx"),
+            models.Index(fields=["origin", "process_status", "last_modified"], name="sip_origin_status_idx"),
+            models.Index(fields=["archivematica_uuid"], name="sip_archivematica_uuid_idx"),
+            models.Index(fields=["created", "id"], name="sip_created_idx"),
+        ]
@@ -0,0 +1,313 @@
+import hashlib
+import io
+import os
+import re
+import tarfile
+import time
+
+from . import routines_helpers as helpers
+
+
+class HashingReader:
+    """Wraps a file object, calculating checksums of data as it is read."""
+
+    def __init__(self, fileobj, algorithms):
+        self.fileobj = fileobj
+        self.hashers = {alg: hashlib.new(alg) for alg in algorithms}
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        for hasher in self.hashers.values():
+            hasher.update(data)
+        return data
+
+    def checksums(self):
+        return {alg: hasher.hexdigest() for alg, hasher in self.hashers.items()}
+
+
+class PackageStreamer:
+    """Restructures a bag and repackages it in a single pass.
+
+    The source package is read member by member and written straight to a new
+    package, with payload files moved from `data/` to `data/objects/` as by
+    `routines_helpers.move_objects_dir`. Checksums of payload files are
+    calculated as they are copied and checked against the source manifests,
+    which are then rewritten. The Archivematica directory structure, rights
+    CSV, processing configuration, updated `bag-info.txt` and tag manifests are
+    added at the end of the package, so the bag is never extracted to disk.
+    """
+
+    # Algorithms supported in source manifests. Payload files are only hashed
+    # with the algorithms of the manifests the source bag contains.
+    algorithms = ("md5", "sha1", "sha256", "sha512")
+    structure_dirs = ("data/objects", "data/logs", "data/metadata", "data/metadata/submissionDocumentation")
+    mode = 0o775
+
+    def __init__(self, src_path, bag_identifier, tmp_dir):
+        self.src_path = src_path
+        self.bag_identifier = bag_identifier
+        self.tmp_dir = tmp_dir
+
+    def create_package(self, dest_dir, bag_info, processing_config, csv_creator=None,
+                       rights_statements=None, package_format="tar.gz", threads=1, compresslevel=9):
+        """Creates a restructured package in `dest_dir`.
+
+        Args:
+            dest_dir (str): directory in which to create the package.
+            bag_info (dict): values to add to `bag-info.txt`.
+            processing_config (str): contents of `processingMCP.xml`.
+            csv_creator (CsvCreator): used to create `rights.csv` if rights_statements are present.
+            rights_statements (list): rights statements to apply to all files.
+            package_format (str): one of `routines_helpers.PACKAGE_FORMATS`.
+            threads (int): number of threads to use for compression.
+            compresslevel (int): gzip compression level.
+
+        Returns:
+            package_path (str): path of the created package.
+        """
+        self.payload = {}
+        self.moved_from = {}
+        self.payload_sizes = {}
+        self.payload_bytes = 0
+        self.tag_files = {}
+        self.manifest_algorithms = self.get_manifest_algorithms()
+        self.written_dirs = set()
+        package_path = os.path.join(dest_dir, "{}.{}".format(self.bag_identifier, package_format))
+        with helpers.atomic_write(package_path) as f:
+            with helpers.open_package(f, package_format, threads, compresslevel) as package:
+                self.copy_members(package)
+                manifests = self.validate_source()
+                for dir in self.structure_dirs:
+                    if dir not in self.written_dirs:
+                        package.addfile(self.get_tarinfo(dir, tarfile.DIRTYPE))
+                if rights_statements and csv_creator:
+                    self.add_rights_csv(package, csv_creator, rights_statements, manifests)
+                self.tag_files["processingMCP.xml"] = processing_config.encode("utf-8")
+                self.update_bag_info(bag_info)
+                self.add_tag_files(package, manifests)
+        return package_path
+
+    def get_tarinfo(self, rel_path, type=tarfile.REGTYPE, size=0):
+        tarinfo = tarfile.TarInfo("{}/{}".format(self.bag_identifier, rel_path))
+        tarinfo.type = type
+        tarinfo.size = size
+        tarinfo.mode = self.mode
+        tarinfo.mtime = int(time.time())
+        return tarinfo
+
+    def add_bytes(self, package, rel_path, data):
+        package.addfile(self.get_tarinfo(rel_path, size=len(data)), io.BytesIO(data))
+
+    def get_manifest_algorithms(self):
+        """Returns the algorithms of the source payload manifests.
+
+        Manifests are usually stored after the payload, so the member headers
+        of the source package are read before anything is copied.
+
+        Raises:
+            Exception: if the bag has no payload manifest, or a manifest uses an unsupported algorithm.
+        """
+        algorithms = []
+        with tarfile.open(self.src_path, "r|*") as src:
+            for member in src:
+                match = re.match(
+                    r"^{}/manifest-(\w+)\.txt$".format(re.escape(self.bag_identifier)), os.path.normpath(member.name))
+                if match and member.isfile():
+                    if match.group(1) not in self.algorithms:
+                        raise Exception(
+                            "Unsupported manifest algorithm for streaming: {}".format(match.group(1)), self.bag_identifier)
+                    algorithms.append(match.group(1))
+        if not algorithms:
+            raise Exception("Bag does not contain a payload manifest", self.bag_identifier)
+        return algorithms
+
+    def get_moved_linkname(self, member, src_rel_path, rel_path):
+        """Returns the target of a link member once payload files have been moved.
+
+        Hard link targets are paths within the package, and relative symbolic
+        link targets are resolved from the directory containing the link.
+        """
+        if member.islnk():
+            target = os.path.normpath(member.linkname)
+            prefix = self.bag_identifier + "/data/"
+            if target.startswith(prefix):
+                return "{}/{}".format(self.bag_identifier, helpers.get_moved_path(target[len(self.bag_identifier) + 1:]))
+            return member.linkname
+        if os.path.isabs(member.linkname):
+            return member.linkname
+        target = os.path.normpath(os.path.join(os.path.dirname(src_rel_path), member.linkname))
+        if target.startswith("data/"):
+            target = helpers.get_moved_path(target)
+        return os.path.relpath(target, os.path.dirname(rel_path))
+
+    def copy_members(self, package):
+        """Copies members of the source package, moving payload files and holding back tag files."""
+        with tarfile.open(self.src_path, "r|*") as src:
+            for member in src:
+                name = os.path.normpath(member.name)
+                if name == self.bag_identifier:
+                    member.name = name
+                    member.mode = self.mode
+                    package.addfile(member)
+                    continue
+                if not name.startswith(self.bag_identifier + "/"):
+                    raise Exception("TAR file member outside bag directory: {}".format(member.name))
+                rel_path = name[len(self.bag_identifier) + 1:]
+                if rel_path == "data" or rel_path.startswith("data/"):
+                    src_rel_path = rel_path
+                    if rel_path != "data":
+                        rel_path = helpers.get_moved_path(rel_path)
+                    member.name = "{}/{}".format(self.bag_identifier, rel_path)
+                    member.mode = self.mode
+                    if member.issym() or member.islnk():
+                        member.linkname = self.get_moved_linkname(member, src_rel_path, rel_path)
+                    if member.isfile():
+                        reader = HashingReader(src.extractfile(member), self.manifest_algorithms)
+                        package.addfile(member, reader)
+                        self.add_payload_file(rel_path, src_rel_path, reader.checksums(), member.size)
+                    elif member.islnk() and member.linkname[len(self.bag_identifier) + 1:] in self.payload:
+                        package.addfile(member)
+                        target = member.linkname[len(self.bag_identifier) + 1:]
+                        self.add_payload_file(rel_path, src_rel_path, self.payload[target], self.payload_sizes[target])
+                    else:
+                        package.addfile(member)
+                        if member.isdir():
+                            self.written_dirs.add(rel_path)
+                elif member.isfile():
+                    self.tag_files[rel_path] = src.extractfile(member).read()
+                elif member.isdir():
+                    member.mode = self.mode
+                    package.addfile(member)
+
+    def add_payload_file(self, rel_path, src_rel_path, checksums, size):
+        self.payload[rel_path] = checksums
+        self.payload_sizes[rel_path] = size
+        self.moved_from[rel_path] = src_rel_path
+        self.payload_bytes += size
+
+    def parse_manifest(self, data):
+        """Returns entries from a manifest as a dict of paths and checksums."""
+        entries = {}
+        for line in data.decode("utf-8").splitlines():
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            checksum, entry_path = re.split(r"\s+", line, maxsplit=1)
+            entry_path = entry_path.lstrip("*").replace("%0D", "\r").replace("%0A", "\n")
+            entries[os.path.normpath(entry_path)] = checksum.lower()
+        return entries
+
+    def get_checksums(self, data, algorithms):
+        return {alg: hashlib.new(alg, data).hexdigest() for alg in algorithms}
+
+    def validate_source(self):
+        """Validates the source bag against the checksums calculated while copying.
+
+        Returns:
+            manifests (dict): algorithms of the source payload manifests mapped to their entries.
+
+        Raises:
+            Exception: if the source bag is incomplete or invalid.
+        """
+        if "bagit.txt" not in self.tag_files:
+            raise Exception("Bag is missing bagit.txt", self.bag_identifier)
+        manifests = {}
+        for rel_path, data in self.tag_files.items():
+            match = re.match(r"^manifest-(\w+)\.txt$", rel_path)
+            if match:
+                manifests[match.group(1)] = self.parse_manifest(data)
+        if sorted(manifests) != sorted(self.manifest_algorithms):
+            raise Exception("Payload manifests changed while streaming", self.bag_identifier)
+        errors = []
+        for alg, entries in manifests.items():
+            for rel_path, checksums in self.payload.items():
+                expected = entries.get(self.moved_from[rel_path])
+                if expected is None:
+                    errors.append("{} not listed in manifest-{}.txt".format(self.moved_from[rel_path], alg))
+                elif expected != checksums[alg]:
+                    errors.append("{} {} validation failed".format(self.moved_from[rel_path], alg))
+            missing = set(entries) - set(self.moved_from.values())
+            errors += ["{} listed in manifest-{}.txt but not found".format(path, alg) for path in sorted(missing)]
+        for rel_path, data in self.tag_files.items():
+            match = re.match(r"^tagmanifest-(\w+)\.txt$", rel_path)
+            if match and match.group(1) in hashlib.algorithms_available:
+                for entry_path, expected in self.parse_manifest(data).items():
+                    if entry_path not in self.tag_files:
+                        errors.append("{} listed in {} but not found".format(entry_path, rel_path))
+                    elif expected != hashlib.new(match.group(1), self.tag_files[entry_path]).hexdigest():
+                        errors.append("{} {} validation failed".format(entry_path, match.group(1)))
+        oxum = self.parse_bag_info().get("Payload-Oxum")
+        if oxum and oxum != "{}.{}".format(self.payload_bytes, len(self.payload)):
+            errors.append("Payload-Oxum validation failed")
+        if errors:
+            raise Exception("Bag validation failed", errors)
+        return manifests
+
+    def add_rights_csv(self, package, csv_creator, rights_statements, algorithms):
+        """Creates a rights CSV for all payload files and adds it to the package."""
+        rel_path = "data/metadata/rights.csv"
+        csv_filepath = os.path.join(self.tmp_dir, "{}.rights.csv".format(self.bag_identifier))
+        if os.path.isfile(csv_filepath):
+            os.remove(csv_filepath)
+        try:
+            csv_creator.create_rights_csv_from_paths(
+                csv_filepath, sorted(p for p in self.payload if p.startswith("data/objects/")), rights_statements)
+            with open(csv_filepath, "rb") as f:
+                data = f.read()
+        finally:
+            if os.path.isfile(csv_filepath):
+                os.remove(csv_filepath)
+        self.add_bytes(package, rel_path, data)
+        self.payload[rel_path] = self.get_checksums(data, algorithms)
+        self.payload_sizes[rel_path] = len(data)
+        self.payload_bytes += len(data)
+
+    def parse_bag_info(self):
+        """Parses `bag-info.txt`, returning a dict of tags with repeated tags as lists."""
+        bag_info = {}
+        name = None
+        for line in self.tag_files.get("bag-info.txt", b"").decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            if line[0] in " \t" and name:
+                value = bag_info[name]
+                if isinstance(value, list):
+                    value[-1] += " " + line.strip()
+                else:
+                    bag_info[name] = value + " " + line.strip()
+                continue
+            name, value = [part.strip() for part in line.split(":", 1)]
+            if name in bag_info:
+                existing = bag_info[name]
+                bag_info[name] = (existing if isinstance(existing, list) else [existing]) + [value]
+            else:
+                bag_info[name] = value
+        return bag_info
+
+    def update_bag_info(self, values):
+        bag_info = self.parse_bag_info()
+        bag_info.update(values)
+        bag_info["Payload-Oxum"] = "{}.{}".format(self.payload_bytes, len(self.payload))
+        lines = []
+        for name in sorted(bag_info):
+            for value in bag_info[name] if isinstance(bag_info[name], list) else [bag_info[name]]:
+                lines.append("{}: {}\n".format(name, re.sub(r"\r|\n", "", str(value))))
+        self.tag_files["bag-info.txt"] = "".join(lines).encode("utf-8")
+
+    def add_tag_files(self, package, manifests):
+        """Adds payload manifests, tag files and tag manifests to the package."""
+        for rel_path in list(self.tag_files):
+            if re.match(r"^(tag)?manifest-\w+\.txt$", rel_path):
+                del self.tag_files[rel_path]
+        for alg in manifests:
+            self.tag_files["manifest-{}.txt".format(alg)] = "".join(
+                "{}  {}\n".format(self.payload[rel_path][alg], rel_path.replace("\r", "%0D").replace("\n", "%0A"))
+                for rel_path in sorted(self.payload)).encode("utf-8")
+        tag_manifests = {}
+        for alg in manifests:
+            tag_manifests["tagmanifest-{}.txt".format(alg)] = "".join(
+                "{}  {}\n".format(hashlib.new(alg, self.tag_files[rel_path]).hexdigest(), rel_path)
+                for rel_path in sorted(self.tag_files)).encode("utf-8")
+        self.tag_files.update(tag_manifests)
+        for rel_path in sorted(self.tag_files):
+            self.add_bytes(package, rel_path, self.tag_files[rel_path])
@@ -0,0 +1,80 @@
+import csv
+import re
+from datetime import datetime
+
+
+class RightsCsvValidator:
+    """Validates a PREMIS rights CSV against the rules Archivematica applies on import.
+
+    Checks that all required columns are present, that basis, copyright status,
+    act and restriction values are allowed, and that dates are ISO 8601 dates
+    (end dates may also be `open`). Archivematica versions before 1.13 reject
+    rows without an act.
+    """
+
+    required_columns = [
+        'file', 'basis', 'status', 'determination_date', 'jurisdiction',
+        'start_date', 'end_date', 'terms', 'citation', 'note', 'grant_act',
+        'grant_restriction', 'grant_start_date', 'grant_end_date',
+        'grant_note', 'doc_id_type', 'doc_id_value', 'doc_id_role']
+    allowed_bases = ['copyright', 'statute', 'license', 'donor', 'policy', 'other']
+    allowed_statuses = ['copyrighted', 'public domain', 'unknown']
+    allowed_acts = ['publish', 'disseminate', 'replicate', 'migrate', 'modify', 'use', 'delete']
+    allowed_restrictions = ['allow', 'disallow', 'conditional']
+    date_columns = ['determination_date', 'start_date', 'end_date', 'grant_start_date', 'grant_end_date']
+    date_formats = {4: "%Y", 7: "%Y-%m", 10: "%Y-%m-%d"}
+    max_errors = 20
+
+    def __init__(self, skip_no_act=False):
+        self.skip_no_act = skip_no_act
+
+    def validate(self, csvfile):
+        """Validates a CSV file object.
+
+        Raises:
+            Exception: if the CSV is invalid, listing the first errors found.
+        """
+        reader = csv.DictReader(csvfile)
+        missing = [column for column in self.required_columns if column not in (reader.fieldnames or [])]
+        if missing:
+            raise Exception("Error validating CSV: missing columns {}".format(", ".join(missing)))
+        errors = []
+        for line_number, row in enumerate(reader, start=2):
+            errors += ["row {}: {}".format(line_number, error) for error in self.get_row_errors(row)]
+            if len(errors) >= self.max_errors:
+                break
+        if errors:
+            raise Exception("Error validating CSV: {}".format("; ".join(errors[:self.max_errors])))
+
+    def get_row_errors(self, row):
+        """Returns a list of errors for a single row."""
+        errors = []
+        if not row['file']:
+            errors.append("file is required")
+        basis = row['basis'].lower()
+        if basis not in self.allowed_bases:
+            errors.append("invalid basis {}".format(row['basis']))
+        if basis == 'copyright' and row['status'].lower() not in self.allowed_statuses:
+            errors.append("invalid copyright status {}".format(row['status']))
+        if row['grant_act']:
+            if row['grant_act'].lower() not in self.allowed_acts:
+                errors.append("invalid act {}".format(row['grant_act']))
+            if row['grant_restriction'].lower() not in self.allowed_restrictions:
+                errors.append("invalid restriction {}".format(row['grant_restriction']))
+        elif self.skip_no_act:
+            errors.append("act is required")
+        for column in self.date_columns:
+            if not self.is_valid_date(row[column], allow_open=column.endswith('end_date')):
+                errors.append("invalid {} {}".format(column, row[column]))
+        return errors
+
+    def is_valid_date(self, value, allow_open=False):
+        if not value or (allow_open and value.lower() == 'open'):
+            return True
+        if not re.match(r"^\d{4}(-\d{2}){0,2}$", value):
+            return False
+        try:
+            datetime.strptime(value, self.date_formats[len(value)])
+        except ValueError:
+            return False
+        return True
@@ -1,27 +1,47 @@
-import json
-from os import remove
-from os.path import isdir, isfile, join
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from itertools import zip_longest
+from os import remove, scandir
+from os.path import basename, isdir, isfile, join
 
 import requests
 from amclient import AMClient, errors
 from asterism import bagit_helpers, file_helpers
+from django.db.models import Count, Q
+from django.utils import timezone
 
 from fornax import settings
 from sip_assembly import routines_helpers as helpers
+from sip_assembly import sessions
 
 from .csv_creator import CsvCreator
 from .models import SIP
+from .package_streamer import PackageStreamer
+
+logger = logging.getLogger(__name__)
 
 
 class ProcessingException(Exception):
     pass
 
 
+def get_streaming_origins():
+    """Returns origins whose SIPs are assembled without being extracted."""
+    return [origin for origin, values in settings.ARCHIVEMATICA_ORIGINS.items() if values.get("streaming_assembly")]
+
+
 class ArchivematicaClientMixin:
     """Mixin to handle communication with Archivematica."""
 
     def get_client(self, origin):
-        """Instantiates an Archivematica client based on SIP origin"""
+        """Instantiates an Archivematica client based on SIP origin.
+
+        Clients hold attributes of the transfer being started, so are not
+        shared, but all clients send requests through a pooled session (see
+        `sessions.SessionRegistry.install`).
+        """
         am_settings = settings.ARCHIVEMATICA_ORIGINS[origin]
         return AMClient(
             am_api_key=am_settings['api_key'],
@@ -31,59 +51,292 @@ class ArchivematicaClientMixin:
             processing_config=am_settings['processing_config']
         )
 
-    def get_processing_config(self, client):
+    def get_processing_config(self, origin, client):
+        """Returns a processing configuration file for an origin, from the cache where possible."""
+        return self.get_processing_config_cache().get(
+            origin, settings.ARCHIVEMATICA_ORIGINS[origin]['processing_config'],
+            lambda: self.fetch_processing_config(client))
+
+    def fetch_processing_config(self, client):
         """Returns a processing configuration file from Archivematica"""
         processing_config = client.get_processing_config()
         if isinstance(processing_config, int):
             raise Exception(errors.error_lookup(processing_config), processing_config)
         return processing_config
 
-    def remove_completed(self, type):
-        """Removes completed transfers and ingests from Archivematica dashboard."""
-        all_completed = []
-        dashboards = []
+    def get_processing_config_cache(self):
+        return helpers.ProcessingConfigCache(
+            join(settings.CACHE_DIR, "processing_configs"), settings.PROCESSING_CONFIG_TTL)
+
+    def warm_processing_configs(self):
+        """Fetches processing configurations for all origins which are not already cached.
+
+        Returns:
+            message (str): a summary including any origins which could not be fetched.
+            origins (list): origins with a cached processing configuration.
+        """
+        warmed = []
+        failed = []
         for origin in settings.ARCHIVEMATICA_ORIGINS:
-            if settings.ARCHIVEMATICA_ORIGINS[origin].get("close_completed"):
-                client = self.get_client(origin)
-                completed = getattr(client, 'close_completed_{}'.format((type)))()
-                dashboards.append(origin)
+            try:
+                self.get_processing_config(origin, self.get_client(origin))
+                warmed.append(origin)
+            except Exception as e:
+                failed.append("{} ({})".format(origin, e))
+        message = "Processing configurations cached."
+        if failed:
+            message = "{} Failed to fetch: {}".format(message, ", ".join(failed))
+        return message, warmed
+
+    def invalidate_processing_configs(self, origin=None):
+        """Removes cached processing configurations for an origin, or all origins."""
+        if origin and origin not in settings.ARCHIVEMATICA_ORIGINS:
+            raise Exception("Unknown origin {}".format(origin))
+        removed = self.get_processing_config_cache().invalidate(origin)
+        return "Processing configuration cache cleared.", removed
+
+    def get_csv_creator(self, origin, client):
+        """Returns a CsvCreator which validates rights CSVs as configured for the origin."""
+        return CsvCreator(
+            settings.ARCHIVEMATICA_VERSION, client,
+            settings.ARCHIVEMATICA_ORIGINS[origin].get("remote_csv_validation", "all"))
+
+    def remove_completed(self, type):
+        """Removes completed transfers or ingests from the Archivematica dashboards of all origins.
+
+        Origins are handled concurrently, so the total time is that of the
+        slowest dashboard.
+
+        Returns:
+            message (str): a message listing the dashboards.
+            results (dict): origins mapped to the UUIDs of removed transfers or ingests.
+
+        Raises:
+            Exception: if removal failed for any origin, with failures and
+                results for all origins.
+        """
+        origins = [origin for origin in settings.ARCHIVEMATICA_ORIGINS if settings.ARCHIVEMATICA_ORIGINS[origin].get("close_completed")]
+        results = {}
+        failures = {}
+        with ThreadPoolExecutor(max_workers=max(min(len(origins), settings.REMOVE_COMPLETED_WORKERS), 1)) as executor:
+            futures = {origin: executor.submit(self.close_completed, origin, type) for origin in origins}
+            for origin, future in futures.items():
+                try:
+                    completed = future.result()
+                except Exception as e:
+                    failures[origin] = str(e)
+                    continue
+                results[origin] = completed.get('close_succeeded', [])
                 if completed.get('close_failed'):
-                    raise Exception(
-                        "Error removing {} from Archivematica dashboard".format(
-                            type), completed['close_failed'])
-                else:
-                    all_completed += completed.get('close_succeeded', [])
+                    failures[origin] = completed['close_failed']
+        if failures:
+            raise Exception(
+                "Error removing {} from Archivematica dashboard".format(type),
+                {"failed": failures, "succeeded": results})
         return "All completed {} removed from dashboards {}".format(
-            type, ", ".join(dashboards)), all_completed
+            type, ", ".join(origins)), results
 
+    def close_completed(self, origin, type):
+        completed = getattr(self.get_client(origin), 'close_completed_{}'.format(type))()
+        if isinstance(completed, int):
+            raise Exception(errors.error_lookup(completed))
+        return completed
 
-class BaseRoutine(object):
-    """Base routine which contains main run method."""
 
-    def run(self):
-        if not SIP.objects.filter(process_status=self.in_process_status).exists():
-            sip = SIP.objects.filter(process_status=self.start_status).first()
+class BaseRoutine(object):
+    """Base routine which contains main run method.
+
+    SIPs are claimed atomically, so several workers can run the same routine
+    at once without processing the same SIP. The number of SIPs which can be
+    in `in_process_status` at the same time is limited by the value in
+    `settings.ROUTINE_CONCURRENCY` for the routine's `concurrency_key`, and
+    the number from each origin by `max_concurrent_sips` in
+    `settings.ARCHIVEMATICA_ORIGINS`.
+    """
+    concurrency_key = None
+
+    def run(self, limit=1, max_seconds=None):
+        """Processes SIPs until `limit` SIPs have been handled or `max_seconds` have elapsed.
+
+        Processing stops early if there are no more SIPs to process, or if a
+        SIP raises a ProcessingException.
+
+        Returns:
+            message (str): the message for a single SIP, or a summary of all messages.
+            bag_identifiers (list): identifiers of all SIPs handled, or None.
+
+        Raises:
+            Exception: if a SIP could not be processed. If other SIPs were
+                processed first, the failed SIP and the processed SIPs are
+                listed.
+        """
+        deadline = time.monotonic() + max_seconds if max_seconds else None
+        message = self.idle_message
+        messages = []
+        processed = []
+        while len(processed) < limit:
+            if deadline and processed and time.monotonic() >= deadline:
+                break
+            try:
+                message, sip, completed = self.run_once()
+            except Exception as e:
+                raise self.get_batch_error(e, processed)
             if sip:
-                sip.process_status = self.in_process_status
-                sip.save()
-                try:
-                    message = self.process_sip(sip)
-                    sip.process_status = self.end_status
-                    sip.save()
-                except ProcessingException as e:
-                    sip.process_status = self.start_status
-                    sip.save()
-                    message = str(e)
-                except Exception as e:
-                    sip.process_status = self.start_status
-                    sip.save()
-                    raise Exception(str(e), sip.bag_identifier)
-            else:
-                message = self.idle_message
-        else:
-            message = "Service currently running"
-            sip = None
-        return (message, [sip.bag_identifier] if sip else None)
+                messages.append(message)
+                processed.append(sip.bag_identifier)
+            if not completed:
+                break
+        return self.get_summary(message, messages, processed)
+
+    def get_batch_error(self, exception, processed):
+        """Returns an exception raised while processing a batch, listing SIPs processed before it."""
+        if not processed:
+            return exception
+        return Exception(
+            "{} SIPs processed before error: {}".format(len(processed), exception.args[0]),
+            {"failed": exception.args[1] if len(exception.args) > 1 else None, "processed": processed})
+
+    def get_summary(self, message, messages, processed):
+        """Returns the message for a single SIP or batch, or a summary of all messages, with processed identifiers."""
+        if not processed:
+            return (message, None)
+        if len(messages) == 1:
+            return (messages[0], processed)
+        return ("{} SIPs processed: {}".format(
+            len(processed), " ".join(dict.fromkeys(messages))), processed)
+
+    def run_once(self, pk=None):
+        """Claims and processes a single SIP.
+
+        Args:
+            pk (int): if set, only the SIP with this primary key is claimed.
+
+        Returns:
+            message (str): a message describing the outcome.
+            sip (SIP): the SIP which was handled, or None.
+            completed (bool): whether the SIP was successfully processed.
+        """
+        if not self.has_capacity():
+            return "Service currently running", None, False
+        sip = self.claim_sip(pk)
+        if not sip:
+            return self.idle_message, None, False
+        try:
+            message = self.process_sip(sip)
+            sip.process_status = self.end_status
+            self.save_sip(sip)
+            return message, sip, True
+        except ProcessingException as e:
+            sip.process_status = self.start_status
+            self.save_sip(sip)
+            return str(e), sip, False
+        except Exception as e:
+            sip.process_status = self.start_status
+            self.save_sip(sip)
+            raise Exception(str(e), sip.bag_identifier)
+
+    def save_sip(self, sip):
+        """Saves a SIP without overwriting statuses recorded by ArchivematicaStatusTracker while it was processed."""
+        sip.save(update_fields=[
+            field.name for field in SIP._meta.concrete_fields
+            if not field.primary_key and field.name not in ArchivematicaStatusTracker.status_fields])
+
+    def get_concurrency(self):
+        """Returns the maximum number of SIPs which can be processed at once."""
+        return settings.ROUTINE_CONCURRENCY.get(self.concurrency_key, 1)
+
+    def has_capacity(self):
+        """Checks whether fewer SIPs than allowed are currently in process."""
+        return SIP.objects.filter(
+            process_status=self.in_process_status).count() < self.get_concurrency()
+
+    def get_origin_concurrency(self, origin):
+        """Returns the maximum number of SIPs from an origin which can be processed at once."""
+        return settings.ARCHIVEMATICA_ORIGINS.get(origin, {}).get("max_concurrent_sips") or self.get_concurrency()
+
+    def get_queryset(self):
+        """Returns SIPs which this routine can process."""
+        return SIP.objects.filter(process_status=self.start_status)
+
+    def get_candidates(self, pk=None):
+        """Returns SIPs which can be claimed, interleaved by origin.
+
+        Origins which already have as many SIPs in process as they are allowed
+        are skipped. Remaining origins are ordered by the number of SIPs they
+        have in process, and then in rotation starting after the origin of the
+        SIP most recently claimed by this routine, so that a large number of
+        SIPs from one origin does not hold up SIPs from other origins. Within
+        an origin, the oldest SIPs are returned first.
+
+        Args:
+            pk (int): if set, only the SIP with this primary key is returned.
+
+        Returns:
+            candidates (list): tuples of SIP primary key and origin.
+        """
+        waiting = self.get_queryset()
+        if pk is not None:
+            waiting = waiting.filter(pk=pk)
+        in_process = dict(
+            SIP.objects.filter(process_status=self.in_process_status).values_list(
+                "origin").annotate(count=Count("pk")).order_by())
+        origins = sorted(waiting.order_by().values_list("origin", flat=True).distinct())
+        last_origin = self.get_last_origin()
+        if last_origin in origins:
+            position = origins.index(last_origin) + 1
+            origins = origins[position:] + origins[:position]
+        origins = sorted(
+            [o for o in origins if in_process.get(o, 0) < self.get_origin_concurrency(o)],
+            key=lambda o: in_process.get(o, 0))
+        per_origin = [
+            list(waiting.filter(origin=origin).order_by("created", "pk").values_list("pk", "origin")[:self.get_concurrency() + 1])
+            for origin in origins]
+        return [c for group in zip_longest(*per_origin) for c in group if c]
+
+    def get_last_origin(self):
+        """Returns the origin of the SIP most recently claimed by this routine in any process.
+
+        Claiming a SIP sets its last modified time, so this is the origin of
+        the most recently modified SIP which is in process or was processed
+        by this routine.
+        """
+        return SIP.objects.filter(
+            process_status__in=[self.in_process_status, self.end_status]).order_by(
+                "-last_modified", "-pk").values_list("origin", flat=True).first()
+
+    def claim_sip(self, pk=None):
+        """Atomically moves the next available SIP into `in_process_status`.
+
+        Claiming is a compare-and-set on `process_status`, so if another worker
+        claims a candidate first the update matches no rows and the next
+        candidate is tried. A claim which pushes the number of SIPs in process
+        over the routine's concurrency limit is released again, as is a claim
+        which pushes an origin over its own limit.
+
+        Args:
+            pk (int): if set, only the SIP with this primary key is claimed.
+
+        Returns:
+            sip (SIP): the claimed SIP, or None if no SIP could be claimed.
+        """
+        for candidate_pk, origin in self.get_candidates(pk):
+            claimed = SIP.objects.filter(pk=candidate_pk, process_status=self.start_status).update(
+                process_status=self.in_process_status, last_modified=timezone.now())
+            if claimed:
+                in_process = SIP.objects.filter(process_status=self.in_process_status)
+                if in_process.count() > self.get_concurrency():
+                    SIP.objects.filter(pk=candidate_pk).update(process_status=self.start_status)
+                    return None
+                if in_process.filter(origin=origin).count() > self.get_origin_concurrency(origin):
+                    SIP.objects.filter(pk=candidate_pk).update(process_status=self.start_status)
+                    continue
+                return SIP.objects.get(pk=candidate_pk)
+        return None
+
+    def get_checksum_cache(self, sip):
+        """Returns the cache of checksums calculated for a SIP's files."""
+        return helpers.ChecksumCache(
+            join(settings.TMP_DIR, "{}.checksums.json".format(sip.bag_identifier)))
 
     def process_sip(self, sip):
         raise NotImplementedError("You must implement a process_sip method")
@@ -95,6 +348,8 @@ class ExtractPackageRoutine(BaseRoutine):
     in_process_status = SIP.EXTRACTING
     end_status = SIP.EXTRACTED
     idle_message = "No SIPs to extract."
+    concurrency_key = "extract"
+    mode = 0o775
 
     def __init__(self):
         self.src_dir = settings.SRC_DIR
@@ -104,13 +359,22 @@ class ExtractPackageRoutine(BaseRoutine):
             if not isdir(dir):
                 raise Exception("Directory does not exist", dir)
 
+    def get_queryset(self):
+        return super().get_queryset().exclude(origin__in=get_streaming_origins())
+
     def process_sip(self, sip):
-        tmp_path = join(self.tmp_dir, "{}.tar.gz".format(sip.bag_identifier))
-        file_helpers.copy_file_or_dir(sip.bag_path, tmp_path)
-        extracted_path = helpers.extract_all(tmp_path, sip.bag_identifier, self.tmp_dir)
-        sip.bag_path = extracted_path
-        helpers.recursive_chmod(sip.bag_path)
-        bagit_helpers.validate(sip.bag_path)
+        checksum_cache = self.get_checksum_cache(sip)
+        checksum_cache.clear()
+        if settings.STREAMING_EXTRACTION:
+            sip.bag_path = helpers.stream_extract(
+                sip.bag_path, sip.bag_identifier, self.tmp_dir, mode=self.mode)
+        else:
+            tmp_path = join(self.tmp_dir, "{}.tar.gz".format(sip.bag_identifier))
+            file_helpers.copy_file_or_dir(sip.bag_path, tmp_path)
+            sip.bag_path = helpers.extract_all(tmp_path, sip.bag_identifier, self.tmp_dir)
+            helpers.recursive_chmod(sip.bag_path, self.mode)
+        helpers.validate_bag(sip.bag_path, settings.CHECKSUM_WORKERS, checksum_cache)
+        checksum_cache.save()
         return "SIP extracted."
 
 
@@ -120,19 +384,22 @@ class RestructurePackageRoutine(BaseRoutine, ArchivematicaClientMixin):
     in_process_status = SIP.RESTRUCTURING
     end_status = SIP.RESTRUCTURED
     idle_message = "No SIPs to restructure."
+    concurrency_key = "restructure"
 
     def process_sip(self, sip):
         client = self.get_client(sip.origin)
         helpers.move_objects_dir(sip.bag_path)
         helpers.create_structure(sip.bag_path)
         if sip.data['rights_statements']:
-            CsvCreator(settings.ARCHIVEMATICA_VERSION, client).create_rights_csv(sip.bag_path, sip.data.get('rights_statements'))
+            self.get_csv_creator(sip.origin, client).create_rights_csv(sip.bag_path, sip.data.get('rights_statements'))
         helpers.add_processing_config(
-            sip.bag_path, self.get_processing_config(client))
+            sip.bag_path, self.get_processing_config(sip.origin, client))
         bagit_helpers.update_bag_info(
             sip.bag_path, {'Internal-Sender-Identifier': sip.bag_identifier})
-        bagit_helpers.update_manifests(sip.bag_path)
-        bagit_helpers.validate(sip.bag_path)
+        checksum_cache = self.get_checksum_cache(sip)
+        helpers.rewrite_manifests(sip.bag_path, settings.CHECKSUM_WORKERS, checksum_cache)
+        helpers.validate_bag(sip.bag_path, settings.CHECKSUM_WORKERS, checksum_cache)
+        checksum_cache.save()
         return "SIP restructured."
 
 
@@ -142,12 +409,47 @@ class AssemblePackageRoutine(BaseRoutine):
     in_process_status = SIP.ASSEMBLING
     end_status = SIP.ASSEMBLED
     idle_message = "No SIPs to assemble."
+    concurrency_key = "assemble"
+
+    def get_package_options(self, sip):
+        """Returns the package format and compression level configured for a SIP's origin."""
+        origin_settings = settings.ARCHIVEMATICA_ORIGINS.get(sip.origin, {})
+        compresslevel = origin_settings.get("compression_level", 9)
+        if compresslevel not in range(10):
+            raise Exception("Invalid compression level", compresslevel)
+        return {
+            "package_format": origin_settings.get("package_format") or "tar.gz",
+            "compresslevel": compresslevel}
 
     def process_sip(self, sip):
-        packaged_path = helpers.create_targz_package(sip.bag_path)
-        destination_path = join(settings.DEST_DIR, "{}.tar.gz".format(sip.bag_identifier))
-        file_helpers.move_file_or_dir(packaged_path, destination_path)
-        sip.bag_path = destination_path
+        sip.bag_path = helpers.create_targz_package(
+            sip.bag_path, settings.COMPRESSION_THREADS, settings.DEST_DIR,
+            **self.get_package_options(sip))
+        self.get_checksum_cache(sip).clear()
+        return "SIP assembled."
+
+
+class StreamAssemblePackageRoutine(AssemblePackageRoutine, ArchivematicaClientMixin):
+    """Restructures and packages SIPs in a single pass without extracting them.
+
+    Used instead of the extract, restructure and assemble routines for SIPs
+    from origins with `streaming_assembly` set.
+    """
+    start_status = SIP.CREATED
+
+    def get_queryset(self):
+        return super().get_queryset().filter(origin__in=get_streaming_origins())
+
+    def process_sip(self, sip):
+        client = self.get_client(sip.origin)
+        sip.bag_path = PackageStreamer(sip.bag_path, sip.bag_identifier, settings.TMP_DIR).create_package(
+            settings.DEST_DIR,
+            {'Internal-Sender-Identifier': sip.bag_identifier},
+            self.get_processing_config(sip.origin, client),
+            csv_creator=self.get_csv_creator(sip.origin, client),
+            rights_statements=sip.data.get('rights_statements'),
+            threads=settings.COMPRESSION_THREADS,
+            **self.get_package_options(sip))
         return "SIP assembled."
 
 
@@ -157,21 +459,129 @@ class StartPackageRoutine(BaseRoutine, ArchivematicaClientMixin):
     in_process_status = SIP.APPROVING
     end_status = SIP.APPROVED
     idle_message = "No transfers to start."
+    concurrency_key = "start"
+    # Archivematica's zipped bag transfer type accepts both .tar and .tar.gz packages.
+    transfer_type = "zipped bag"
+    in_flight_statuses = ["PROCESSING"]
+
+    def __init__(self):
+        self.in_flight = {}
+        self.in_flight_counted = {}
+
+    def get_queryset(self):
+        """Returns SIPs waiting to be started, skipping origins which have no free transfer slots."""
+        waiting = super().get_queryset()
+        origins = waiting.order_by().values_list("origin", flat=True).distinct()
+        saturated = [origin for origin in origins if self.is_saturated(origin)]
+        return waiting.exclude(origin__in=saturated)
+
+    def is_saturated(self, origin):
+        """Checks whether an origin has no free transfer slots. Unknown origins are always saturated."""
+        if origin not in settings.ARCHIVEMATICA_ORIGINS:
+            return True
+        max_transfers = settings.ARCHIVEMATICA_ORIGINS[origin].get("max_concurrent_transfers", 1)
+        return self.get_in_flight(origin) >= max_transfers
+
+    def get_in_flight(self, origin):
+        """Returns the number of transfers from an origin which are processing in Archivematica.
+
+        Counts are kept for ARCHIVEMATICA_STATUS_MAX_AGE seconds and
+        incremented as transfers are started, so claiming each SIP in a run
+        does not send requests to Archivematica.
+        """
+        counted = self.in_flight_counted.get(origin)
+        if counted is None or time.monotonic() - counted >= settings.ARCHIVEMATICA_STATUS_MAX_AGE:
+            self.in_flight[origin] = self.count_in_flight(origin)
+            self.in_flight_counted[origin] = time.monotonic()
+        return self.in_flight[origin]
+
+    def count_in_flight(self, origin):
+        """Counts transfers from an origin which are processing in Archivematica.
+
+        Statuses are read from the database, as recorded by
+        ArchivematicaStatusTracker, and are only fetched from Archivematica if
+        they are older than ARCHIVEMATICA_STATUS_MAX_AGE. A transfer whose
+        status cannot be fetched is counted as processing.
+        """
+        tracker = ArchivematicaStatusTracker()
+        client = None
+        count = 0
+        for sip in tracker.get_queryset(origin).filter(
+                Q(archivematica_status__isnull=True) | Q(archivematica_status__in=self.in_flight_statuses)):
+            checked = sip.archivematica_status_checked
+            if not checked or (timezone.now() - checked).total_seconds() >= settings.ARCHIVEMATICA_STATUS_MAX_AGE:
+                try:
+                    client = client or self.get_client(origin)
+                    tracker.update_status(sip, client)
+                except Exception as e:
+                    logger.warning("Unable to fetch Archivematica status for %s: %s", sip.bag_identifier, e)
+                    count += 1
+                    continue
+            if sip.archivematica_status in [None] + self.in_flight_statuses:
+                count += 1
+        return count
 
     def process_sip(self, sip):
         """Starts and approves a transfer in Archivematica."""
-        last_started = SIP.objects.filter(process_status__in=[SIP.APPROVED, SIP.CLEANED_UP], origin=sip.origin).last()
+        if self.is_saturated(sip.origin):
+            raise ProcessingException("Maximum number of transfers are processing, waiting until one finishes.")
         client = self.get_client(sip.origin)
-        if getattr(last_started, "archivematica_uuid", None) and client.get_unit_status(last_started.archivematica_uuid)['status'] == 'PROCESSING':
-            raise ProcessingException("Another transfer is processing, waiting until it finishes.")
-        else:
-            client.transfer_directory = "{}.tar.gz".format(
-                sip.bag_identifier)
-            client.transfer_name = sip.bag_identifier
-            client.transfer_type = 'zipped bag'
-            started = client.create_package()
-            sip.archivematica_uuid = started.get("id")
-            return "Transfer started."
+        client.transfer_directory = basename(sip.bag_path)
+        client.transfer_name = sip.bag_identifier
+        client.transfer_type = self.transfer_type
+        started = client.create_package()
+        sip.archivematica_uuid = started.get("id")
+        sip.archivematica_started = timezone.now()
+        self.in_flight[sip.origin] = self.in_flight.get(sip.origin, 0) + 1
+        return "Transfer started."
+
+
+class ArchivematicaStatusTracker(ArchivematicaClientMixin):
+    """Records the status of transfers started in Archivematica."""
+    completed_statuses = ["COMPLETE", "FAILED", "REJECTED"]
+    status_fields = ["archivematica_status", "archivematica_status_checked", "archivematica_completed"]
+
+    def get_queryset(self, origin):
+        return SIP.objects.filter(
+            origin=origin,
+            archivematica_started__isnull=False,
+            archivematica_completed__isnull=True).order_by("archivematica_started", "pk")
+
+    def update_status(self, sip, client):
+        """Fetches the status of a SIP's transfer or ingest from Archivematica and saves it.
+
+        Only status fields are updated, so changes made by routines processing
+        the SIP at the same time are not overwritten. Transfers which
+        Archivematica no longer knows about are recorded as failed.
+        """
+        try:
+            status = client.get_unit_status(sip.archivematica_uuid)
+        except requests.exceptions.HTTPError as e:
+            if e.response is None or e.response.status_code != 404:
+                raise
+            status = {"status": "FAILED"}
+        sip.archivematica_status = status.get("status")
+        sip.archivematica_status_checked = timezone.now()
+        if sip.archivematica_status in self.completed_statuses:
+            sip.archivematica_completed = sip.archivematica_status_checked
+        SIP.objects.filter(pk=sip.pk).update(**{field: getattr(sip, field) for field in self.status_fields})
+        return sip.archivematica_status
+
+    def run(self, origin):
+        """Updates the status of all transfers from an origin which have not completed."""
+        client = self.get_client(origin)
+        updated = []
+        failed = []
+        for sip in self.get_queryset(origin):
+            try:
+                self.update_status(sip, client)
+                updated.append(sip.bag_identifier)
+            except Exception as e:
+                failed.append("{} ({})".format(sip.bag_identifier, e))
+        message = "Archivematica statuses updated."
+        if failed:
+            message = "{} Failed to update: {}".format(message, ", ".join(failed))
+        return message, updated
 
 
 class RemoveCompletedIngestsRoutine(ArchivematicaClientMixin):
@@ -189,24 +599,81 @@ class RemoveCompletedTransfersRoutine(ArchivematicaClientMixin):
 
 
 class CleanupPackageRequester(BaseRoutine):
-    """Requests cleanup of SIP files in the source directory by another service."""
+    """Requests cleanup of SIP files in the source directory by another service.
+
+    If CLEANUP_BATCH_SIZE is greater than 1, SIPs are claimed in batches of up
+    to that size and cleanup of each batch is requested in a single request.
+    `limit` is then the maximum number of batches to send.
+    """
     start_status = SIP.APPROVED
     in_process_status = SIP.CLEANING_UP
     end_status = SIP.CLEANED_UP
     idle_message = "No SIPs to clean up."
+    concurrency_key = "cleanup"
+
+    def get_batch_size(self):
+        return max(settings.CLEANUP_BATCH_SIZE, 1)
+
+    def get_concurrency(self):
+        """Allows a full batch of SIPs for each request which can be sent at the same time."""
+        return super().get_concurrency() * self.get_batch_size()
+
+    def run(self, limit=1, max_seconds=None):
+        if self.get_batch_size() == 1:
+            return super().run(limit, max_seconds)
+        deadline = time.monotonic() + max_seconds if max_seconds else None
+        message = self.idle_message
+        messages = []
+        processed = []
+        while len(messages) < limit:
+            if deadline and processed and time.monotonic() >= deadline:
+                break
+            if not self.has_capacity():
+                message = "Service currently running"
+                break
+            batch = self.claim_batch()
+            if not batch:
+                break
+            try:
+                messages.append(self.process_batch(batch))
+            except Exception as e:
+                raise self.get_batch_error(e, processed)
+            processed += [sip.bag_identifier for sip in batch]
+        return self.get_summary(message, messages, processed)
+
+    def claim_batch(self):
+        batch = []
+        while len(batch) < self.get_batch_size():
+            sip = self.claim_sip()
+            if not sip:
+                break
+            batch.append(sip)
+        return batch
+
+    def process_batch(self, sips):
+        identifiers = [sip.bag_identifier for sip in sips]
+        try:
+            sessions.cleanup_dispatcher.send(identifiers)
+        except Exception as e:
+            for sip in sips:
+                sip.process_status = self.start_status
+                self.save_sip(sip)
+            raise Exception(str(e), identifiers)
+        for sip in sips:
+            sip.process_status = self.end_status
+            self.save_sip(sip)
+        return "Request sent to clean up {} SIPs.".format(len(sips))
 
     def process_sip(self, sip):
-        r = requests.post(
-            settings.CLEANUP_URL,
-            data=json.dumps({"identifier": sip.bag_identifier}),
-            headers={"Content-Type": "application/json"})
-        if r.status_code != 200:
-            raise Exception(r.reason)
+        sessions.cleanup_dispatcher.send([sip.bag_identifier])
         return "Request sent to clean up SIP."
 
 
 class CleanupPackageRoutine(object):
-    """Removes files in destination directory."""
+    """Removes files in destination directory.
+
+    `identifier` may be a single SIP identifier or a list of identifiers.
+    """
 
     def __init__(self, identifier):
         self.identifier = identifier
@@ -215,12 +682,97 @@ class CleanupPackageRoutine(object):
                 "No identifier submitted, unable to perform CleanupRoutine.", None)
 
     def run(self):
+        if isinstance(self.identifier, list):
+            return self.remove_packages(self.identifier)
         try:
-            self.filepath = "{}.tar.gz".format(
-                join(settings.DEST_DIR, self.identifier))
-            if isfile(self.filepath):
-                remove(self.filepath)
+            if self.remove_package(self.identifier):
                 return "Transfer removed.", self.identifier
             return "Transfer was not found.", self.identifier
         except Exception as e:
             raise Exception(e, self.identifier)
+
+    def remove_package(self, identifier):
+        """Removes a SIP's package in any format, returning whether one was found."""
+        for package_format in helpers.PACKAGE_FORMATS:
+            filepath = "{}.{}".format(join(settings.DEST_DIR, identifier), package_format)
+            if isfile(filepath):
+                remove(filepath)
+                return True
+        return False
+
+    def remove_packages(self, identifiers):
+        """Removes packages for a list of SIPs, continuing past failures.
+
+        Raises:
+            Exception: if any package could not be removed, with removed and
+                failed identifiers.
+        """
+        removed = []
+        failed = {}
+        for identifier in identifiers:
+            try:
+                if self.remove_package(identifier):
+                    removed.append(identifier)
+            except Exception as e:
+                failed[identifier] = str(e)
+        if failed:
+            raise Exception("Error removing transfers", {"failed": failed, "removed": removed})
+        return "{} of {} transfers removed.".format(len(removed), len(identifiers)), removed
+
+
+class CleanupSweepRoutine(object):
+    """Removes packages in the destination directory whose SIPs have finished processing.
+
+    The destination directory is scanned once, and packages are removed if
+    their SIP has reached `min_status` (but is not in process) and was last
+    modified more than `min_age` seconds ago. Packages without a matching SIP
+    are left in place. Only SIPs which have been approved in Archivematica can
+    be swept, since earlier packages have not yet been copied from the
+    destination directory.
+    """
+    statuses = [SIP.APPROVED, SIP.CLEANED_UP]
+    query_chunk_size = 500
+
+    def __init__(self, min_status=None, min_age=None, dry_run=False):
+        self.min_status = int(min_status if min_status is not None else settings.CLEANUP_SWEEP_STATUS)
+        self.min_age = float(min_age if min_age is not None else settings.CLEANUP_SWEEP_MIN_AGE)
+        self.dry_run = dry_run
+        if self.min_status not in self.statuses:
+            raise Exception("Invalid process status for cleanup sweep", self.min_status)
+
+    def run(self):
+        packages = self.get_packages()
+        removed = []
+        reclaimed = 0
+        for identifier in self.get_removable(list(packages)):
+            path, size = packages[identifier]
+            if not self.dry_run:
+                remove(path)
+            removed.append(identifier)
+            reclaimed += size
+        message = "{} transfers {}, {} bytes reclaimed.".format(
+            len(removed), "to remove" if self.dry_run else "removed", reclaimed)
+        return message, removed
+
+    def get_packages(self):
+        """Returns the path and size of each package in the destination directory, keyed by identifier."""
+        formats = sorted(helpers.PACKAGE_FORMATS, key=len, reverse=True)
+        packages = {}
+        with scandir(settings.DEST_DIR) as entries:
+            for entry in entries:
+                package_format = next((f for f in formats if entry.name.endswith(".{}".format(f))), None)
+                if package_format and entry.is_file():
+                    identifier = entry.name[:-len(package_format) - 1]
+                    packages[identifier] = (entry.path, entry.stat().st_size)
+        return packages
+
+    def get_removable(self, identifiers):
+        """Returns identifiers of SIPs whose packages can be removed."""
+        cutoff = timezone.now() - timedelta(seconds=self.min_age)
+        removable = []
+        for i in range(0, len(identifiers), self.query_chunk_size):
+            removable += SIP.objects.filter(
+                bag_identifier__in=identifiers[i:i + self.query_chunk_size],
+                process_status__in=self.statuses[self.statuses.index(self.min_status):],
+                last_modified__lte=cutoff).values_list("bag_identifier", flat=True)
+        return removable
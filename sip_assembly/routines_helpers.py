@@ -1,7 +1,25 @@
+import hashlib
+import json
+import logging
 import os
+import shutil
+import tarfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
+import bagit
 from asterism import file_helpers
 
+from .gzip_writer import ParallelGzipWriter
+
+logger = logging.getLogger(__name__)
+
+# Package formats mapped to whether or not they are compressed.
+PACKAGE_FORMATS = {"tar.gz": True, "tar": False}
+
 
 def extract_all(sip_path, sip_identifier, extract_dir):
     """Extracts a tar.gz file to the `extract dir` directory"""
@@ -16,6 +34,40 @@ def extract_all(sip_path, sip_identifier, extract_dir):
         raise Exception("Unrecognized archive format")
 
 
+def stream_extract(sip_path, sip_identifier, extract_dir, mode=None):
+    """Extracts a tar.gz file to the `extract dir` directory without copying it.
+
+    The archive is read sequentially from its current location, which may be
+    read-only, so only the extracted files are written to `extract_dir`. If
+    `mode` is set, it replaces the permissions stored in the archive as each
+    member is written, so that `recursive_chmod` does not need to be run.
+
+    Members, and the targets of symbolic and hard links, which would resolve
+    outside `extract_dir` are rejected.
+    """
+    ext = os.path.splitext(sip_path)[-1]
+    if ext not in ['.tgz', '.tar.gz', '.gz']:
+        raise Exception("Unrecognized archive format")
+    extract_root = os.path.realpath(extract_dir)
+    try:
+        with tarfile.open(sip_path, "r|*") as tar:
+            for member in tar:
+                target = os.path.realpath(os.path.join(extract_root, member.name))
+                if os.path.commonpath([extract_root, target]) != extract_root:
+                    raise Exception("TAR file member outside extraction directory: {}".format(member.name))
+                if member.issym() or member.islnk():
+                    link_dir = os.path.dirname(os.path.join(extract_root, member.name)) if member.issym() else extract_root
+                    link_target = os.path.realpath(os.path.join(link_dir, member.linkname))
+                    if os.path.commonpath([extract_root, link_target]) != extract_root:
+                        raise Exception("TAR file link outside extraction directory: {}".format(member.name))
+                if mode is not None:
+                    member.mode = mode
+                tar.extract(member, extract_root)
+    except (tarfile.TarError, OSError) as e:
+        raise Exception("Error extracting TAR file.", str(e))
+    return os.path.join(extract_dir, sip_identifier)
+
+
 def move_objects_dir(bag_path):
     """Moves the objects directory within a bag"""
     src = os.path.join(bag_path, 'data')
@@ -27,6 +79,223 @@ def move_objects_dir(bag_path):
             os.rename(os.path.join(src, fname), os.path.join(dest, fname))
 
 
+def get_moved_path(path):
+    """Returns the path of a payload file after `move_objects_dir` has been run."""
+    parts = path.split("/")
+    if len(parts) > 1 and parts[1] == "objects":
+        return path
+    return "/".join([parts[0], "objects"] + parts[1:])
+
+
+class ChecksumCache:
+    """Stores file checksums between routines.
+
+    Entries are keyed on the device, inode, size and modification time of a
+    file, so they remain valid when a file is renamed within a filesystem but
+    not once its contents are changed. The cache is persisted as a JSON file.
+    """
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self.lock = threading.Lock()
+        try:
+            with open(cache_path, "r") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def get_key(self, file_path):
+        stat = os.stat(file_path)
+        return "{}:{}:{}:{}".format(stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def get(self, file_path, algorithms):
+        """Returns cached checksums for a file, or None if any algorithm is missing."""
+        cached = self.entries.get(self.get_key(file_path), {})
+        if all(alg in cached for alg in algorithms):
+            return {alg: cached[alg] for alg in algorithms}
+
+    def set(self, file_path, checksums):
+        with self.lock:
+            self.entries.setdefault(self.get_key(file_path), {}).update(checksums)
+
+    def save(self):
+        with self.lock:
+            with open(self.cache_path, "w") as f:
+                json.dump(self.entries, f)
+
+    def clear(self):
+        self.entries = {}
+        if os.path.isfile(self.cache_path):
+            os.remove(self.cache_path)
+
+
+class ProcessingConfigCache:
+    """Stores Archivematica processing configurations on disk.
+
+    Configurations are stored per origin and processing configuration name,
+    so they are shared between workers. Entries older than `ttl` seconds are
+    fetched again, but a stale entry is used if fetching fails.
+    """
+
+    def __init__(self, cache_dir, ttl):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+
+    def get_path(self, origin, name):
+        return os.path.join(self.cache_dir, "{}.{}.xml".format(origin, name))
+
+    def get(self, origin, name, fetch):
+        """Returns a cached processing configuration, calling `fetch` to refresh it if necessary."""
+        cache_path = self.get_path(origin, name)
+        try:
+            age = time.time() - os.path.getmtime(cache_path)
+        except OSError:
+            age = None
+        if age is None or age >= self.ttl:
+            try:
+                processing_config = fetch()
+            except Exception as e:
+                if age is None:
+                    raise
+                logger.warning(
+                    "Unable to refresh processing configuration %s for %s, using cached copy from %d seconds ago: %s",
+                    name, origin, age, e)
+            else:
+                self.set(origin, name, processing_config)
+                return processing_config
+        with open(cache_path, "r") as f:
+            return f.read()
+
+    def set(self, origin, name, processing_config):
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir, exist_ok=True)
+        with atomic_write(self.get_path(origin, name)) as f:
+            f.write(processing_config.encode("utf-8"))
+
+    def invalidate(self, origin=None):
+        """Removes cached configurations for an origin, or for all origins if none is given.
+
+        Returns:
+            removed (list): filenames of removed configurations.
+        """
+        removed = []
+        if os.path.isdir(self.cache_dir):
+            for filename in sorted(os.listdir(self.cache_dir)):
+                if filename.endswith(".xml") and (origin is None or filename.startswith("{}.".format(origin))):
+                    os.remove(os.path.join(self.cache_dir, filename))
+                    removed.append(filename)
+        return removed
+
+
+def get_checksums(file_path, algorithms, cache=None):
+    """Calculates checksums for a file in each algorithm, reading the file once.
+
+    If a ChecksumCache is passed, cached checksums are returned where available
+    and newly calculated checksums are added to the cache.
+    """
+    if cache is not None:
+        cached = cache.get(file_path, algorithms)
+        if cached:
+            return cached
+    hashers = {alg: hashlib.new(alg) for alg in algorithms}
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            for hasher in hashers.values():
+                hasher.update(chunk)
+    checksums = {alg: hasher.hexdigest() for alg, hasher in hashers.items()}
+    if cache is not None:
+        cache.set(file_path, checksums)
+    return checksums
+
+
+def calculate_checksums(files, workers=1, cache=None):
+    """Calculates checksums for many files using a pool of threads.
+
+    hashlib releases the GIL while hashing, so reading and hashing of
+    different files overlap across threads. Only a few files per worker are
+    queued at a time, so memory use does not grow with the number of files.
+
+    Args:
+        files (dict): file paths mapped to a list of algorithms to use for each.
+        workers (int): number of threads to use.
+        cache (ChecksumCache): optional cache of previously calculated checksums.
+
+    Returns:
+        checksums (dict): file paths mapped to a dict of algorithms and checksums.
+    """
+    checksums = {}
+    pending = deque()
+    max_pending = max(workers, 1) * 4
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        for file_path, algorithms in files.items():
+            pending.append((file_path, executor.submit(get_checksums, file_path, algorithms, cache=cache)))
+            while len(pending) >= max_pending:
+                file_path, future = pending.popleft()
+                checksums[file_path] = future.result()
+        for file_path, future in pending:
+            checksums[file_path] = future.result()
+    return checksums
+
+
+def validate_bag(bag_path, workers=1, cache=None):
+    """Validates a bag, calculating checksums for payload and tag files in parallel.
+
+    Raises:
+        bagit.BagValidationError: if the bag is incomplete or checksums do not match.
+    """
+    bag = bagit.Bag(bag_path)
+    bag.validate(completeness_only=True)
+    files = {
+        os.path.join(bag_path, bag.normalized_filesystem_names.get(rel_path, rel_path)): rel_path
+        for rel_path in bag.entries}
+    checksums = calculate_checksums(
+        {file_path: list(bag.entries[rel_path]) for file_path, rel_path in files.items()}, workers, cache)
+    errors = []
+    for file_path, rel_path in files.items():
+        for alg, expected in bag.entries[rel_path].items():
+            if expected.lower() != checksums[file_path][alg]:
+                errors.append(bagit.ChecksumMismatch(
+                    rel_path, alg, expected.lower(), checksums[file_path][alg]))
+    if errors:
+        raise bagit.BagValidationError("Bag validation failed", errors)
+    return True
+
+
+def rewrite_manifests(bag_path, workers=1, cache=None):
+    """Updates manifests after objects have been moved within a bag.
+
+    Checksums already recorded in the payload manifests are carried over to
+    the paths the files were moved to by `move_objects_dir`, so only payload
+    files which were not previously listed (such as `rights.csv`) are read,
+    using `workers` threads. Payload-Oxum and tag manifests are then updated.
+    """
+    bag = bagit.Bag(bag_path)
+    existing = {get_moved_path(path): checksums for path, checksums in bag.payload_entries().items()}
+    entries = {}
+    unlisted = {}
+    total_bytes = 0
+    for root, dirs, files in os.walk(os.path.join(bag_path, "data")):
+        for fname in files:
+            file_path = os.path.join(root, fname)
+            rel_path = os.path.relpath(file_path, bag_path)
+            checksums = existing.get(rel_path, {})
+            if all(alg in checksums for alg in bag.algorithms):
+                entries[rel_path] = checksums
+            else:
+                unlisted[file_path] = bag.algorithms
+            total_bytes += os.path.getsize(file_path)
+    for file_path, checksums in calculate_checksums(unlisted, workers, cache).items():
+        entries[os.path.relpath(file_path, bag_path)] = checksums
+    for alg in bag.algorithms:
+        manifest_path = os.path.join(bag_path, "manifest-{}.txt".format(alg))
+        with open(manifest_path, "w", encoding=bag.encoding) as manifest:
+            for rel_path in sorted(entries):
+                manifest.write("{}  {}\n".format(
+                    entries[rel_path][alg], rel_path.replace("\r", "%0D").replace("\n", "%0A")))
+    bag.info["Payload-Oxum"] = "{}.{}".format(total_bytes, len(entries))
+    bag.save()
+
+
 def create_structure(bag_path):
     """Creates Archivematica-compliant directory structure within a bag"""
     log_dir = os.path.join(bag_path, 'data', 'logs')
@@ -54,16 +323,79 @@ def add_processing_config(bag_path, data):
         f.write(data)
 
 
-def create_targz_package(sip_path):
-    """Creates a compressed archive file from a bag"""
-    tar_path = "{}.tar.gz".format(sip_path)
-    file_helpers.make_tarfile(
-        sip_path, tar_path, compressed=True, remove_src=True)
+@contextmanager
+def atomic_write(path):
+    """Opens a file for writing which only appears at `path` once complete.
+
+    Data is written to a hidden temporary file in the same directory, which is
+    renamed into place when the block exits, or removed if an exception is raised.
+    """
+    partial_path = os.path.join(os.path.dirname(path), ".{}.part".format(os.path.basename(path)))
+    try:
+        with open(partial_path, "wb") as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(partial_path, path)
+    except BaseException:
+        if os.path.isfile(partial_path):
+            os.remove(partial_path)
+        raise
+
+
+@contextmanager
+def open_package(fileobj, package_format="tar.gz", threads=1, compresslevel=9):
+    """Opens a tar file for writing a package to `fileobj`.
+
+    Args:
+        fileobj (file): file object to which the package is written.
+        package_format (str): one of PACKAGE_FORMATS.
+        threads (int): if greater than one, the package is compressed in parallel.
+        compresslevel (int): gzip compression level, from 0 to 9.
+    """
+    if package_format not in PACKAGE_FORMATS:
+        raise Exception("Unrecognized package format", package_format)
+    if not PACKAGE_FORMATS[package_format]:
+        with tarfile.open(fileobj=fileobj, mode="w") as tar:
+            yield tar
+    elif threads > 1:
+        with ParallelGzipWriter(fileobj, threads=threads, compresslevel=compresslevel) as gz:
+            with tarfile.open(fileobj=gz, mode="w|") as tar:
+                yield tar
+    else:
+        with tarfile.open(fileobj=fileobj, mode="w:gz", compresslevel=compresslevel) as tar:
+            yield tar
+
+
+def create_targz_package(sip_path, threads=1, output_dir=None, package_format="tar.gz", compresslevel=9):
+    """Creates an archive file from a bag.
+
+    The archive is written to `output_dir` (by default the directory containing
+    the bag) with `atomic_write`, so a partially written archive is never
+    visible under its final name.
+
+    Args:
+        sip_path (str): path to the bag.
+        threads (int): if greater than one, the archive is compressed in parallel.
+        output_dir (str): directory in which to create the archive.
+        package_format (str): one of PACKAGE_FORMATS.
+        compresslevel (int): gzip compression level, from 0 to 9.
+    """
+    if package_format not in PACKAGE_FORMATS:
+        raise Exception("Unrecognized package format", package_format)
+    output_dir = output_dir or os.path.dirname(sip_path)
+    tar_path = os.path.join(output_dir, "{}.{}".format(os.path.basename(sip_path), package_format))
+    with atomic_write(tar_path) as f:
+        with open_package(f, package_format, threads, compresslevel) as tar:
+            tar.add(sip_path, arcname=os.path.basename(sip_path))
+    shutil.rmtree(sip_path)
     return tar_path
 
 
 def recursive_chmod(dir, mode=0o775):
-    """Sets file and directory permissions recursively."""
+    """Sets file and directory permissions recursively.
+
+    Used when permissions could not be set during extraction."""
     for root, dirs, files in os.walk(dir):
         for d in dirs:
             os.chmod(os.path.join(root, d), mode)
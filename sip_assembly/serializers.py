@@ -11,6 +11,9 @@ class SIPSerializer(serializers.HyperlinkedModelSerializer):
             'url',
             'bag_identifier',
             'archivematica_uuid',
+            'archivematica_status',
+            'archivematica_started',
+            'archivematica_completed',
             'origin',
             'bag_path',
             'process_status',
@@ -30,3 +33,17 @@ class SIPListSerializer(serializers.HyperlinkedModelSerializer):
             'process_status',
             'created',
             'last_modified')
+
+
+class SIPBulkSerializer(serializers.ModelSerializer):
+    """Validates SIPs created in bulk, which may already exist."""
+
+    class Meta:
+        model = SIP
+        fields = (
+            'bag_identifier',
+            'origin',
+            'bag_path',
+            'process_status',
+            'data')
+        extra_kwargs = {'bag_identifier': {'validators': []}}
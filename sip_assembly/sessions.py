@@ -0,0 +1,155 @@
+import json
+import threading
+
+import requests
+from amclient import utils as amclient_utils
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from fornax import settings
+
+RETRY_STATUSES = [502, 503, 504]
+
+
+def create_session(retries, backoff_factor, pool_connections=1, pool_maxsize=10,
+                   allowed_methods=Retry.DEFAULT_ALLOWED_METHODS):
+    """Returns a session which keeps connections alive and retries failed requests.
+
+    Requests using `allowed_methods` are retried with exponential backoff if
+    they fail or receive a response with a status in RETRY_STATUSES. Other
+    requests are only retried if a connection could not be made.
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=allowed_methods,
+        raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class PooledRequests:
+    """Sends amclient requests through a shared session.
+
+    amclient calls `requests.request` for every API call, which opens a new
+    connection each time. An instance of this class replaces the `requests`
+    module within amclient, so connections to each Archivematica instance are
+    kept alive and reused. Other attributes, such as exception classes, are
+    taken from `requests`.
+
+    This relies on amclient sending every request through
+    `amclient.utils.requests`, which is true of the version pinned in
+    requirements.in.
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", settings.ARCHIVEMATICA_REQUEST_TIMEOUT)
+        return self.registry.get_session().request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+
+class SessionRegistry:
+    """Holds the process-wide session used by Archivematica clients.
+
+    The session keeps a pool of connections for each origin's Archivematica
+    instance. Idempotent requests which fail to connect or receive a 502, 503
+    or 504 response are retried with exponential backoff. Other requests are
+    only retried if a connection could not be made.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.session = None
+
+    def install(self):
+        """Routes amclient requests through the shared session.
+
+        Called once when the application is loaded. The session itself is
+        created when the first request is sent.
+        """
+        if not isinstance(amclient_utils.requests, PooledRequests):
+            amclient_utils.requests = PooledRequests(self)
+
+    def get_session(self):
+        """Returns the shared session, creating it if necessary."""
+        with self.lock:
+            if self.session is None:
+                self.session = self.create_session()
+            return self.session
+
+    def create_session(self):
+        return create_session(
+            settings.ARCHIVEMATICA_REQUEST_RETRIES, settings.ARCHIVEMATICA_RETRY_BACKOFF,
+            pool_connections=len(settings.ARCHIVEMATICA_ORIGINS), pool_maxsize=settings.ARCHIVEMATICA_POOL_SIZE)
+
+    def close(self):
+        """Closes pooled connections. A new session is created for the next request."""
+        with self.lock:
+            if self.session is not None:
+                self.session.close()
+                self.session = None
+
+
+class CleanupDispatcher:
+    """Sends requests to clean up SIPs to the service which delivered them.
+
+    Requests are sent over a pooled session with a timeout. Cleanup requests
+    are idempotent, so they are retried with exponential backoff on server
+    errors as well as connection failures. If CLEANUP_BATCH_SIZE is greater
+    than 1, a single request is sent with a list of identifiers, otherwise a
+    request is sent for each identifier.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.session = None
+
+    def get_session(self):
+        with self.lock:
+            if self.session is None:
+                self.session = create_session(
+                    settings.CLEANUP_REQUEST_RETRIES, settings.CLEANUP_RETRY_BACKOFF, allowed_methods=None)
+            return self.session
+
+    def get_payloads(self, identifiers):
+        if settings.CLEANUP_BATCH_SIZE > 1:
+            return [{"identifiers": list(identifiers)}]
+        return [{"identifier": identifier} for identifier in identifiers]
+
+    def send(self, identifiers):
+        """Requests cleanup of SIPs.
+
+        Raises:
+            Exception: if a request does not succeed after retries.
+        """
+        session = self.get_session()
+        for payload in self.get_payloads(identifiers):
+            r = session.post(
+                settings.CLEANUP_URL,
+                data=json.dumps(payload),
+                headers={"Content-Type": "application/json"},
+                timeout=settings.CLEANUP_REQUEST_TIMEOUT)
+            if r.status_code != 200:
+                raise Exception(r.reason)
+
+    def close(self):
+        with self.lock:
+            if self.session is not None:
+                self.session.close()
+                self.session = None
+
+
+registry = SessionRegistry()
+cleanup_dispatcher = CleanupDispatcher()
@@ -1,26 +1,48 @@
+import csv
+import gzip
 import json
 import random
 import shutil
+import stat
 import tarfile
-from os import listdir, makedirs
-from os.path import basename, isdir, isfile, join
+import threading
+import time
+from datetime import timedelta
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from os import cpu_count, environ, link, listdir, lstat, makedirs, walk
+from os.path import basename, getsize, isdir, isfile, join, lexists, relpath
+from unittest import skipUnless
 from unittest.mock import patch
 
 import bagit
+import requests
 from amclient import errors, utils
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
 from fornax import settings
 
+from . import routines_helpers, sessions
 from .csv_creator import CsvCreator
+from .gzip_writer import ParallelGzipWriter
 from .models import SIP
-from .routines import (ArchivematicaClientMixin, AssemblePackageRoutine,
-                       BaseRoutine, CleanupPackageRequester,
-                       CleanupPackageRoutine, ExtractPackageRoutine,
+from .package_streamer import HashingReader, PackageStreamer
+from .rights_validator import RightsCsvValidator
+from .routines import (ArchivematicaClientMixin, ArchivematicaStatusTracker,
+                       AssemblePackageRoutine, BaseRoutine,
+                       CleanupPackageRequester, CleanupPackageRoutine,
+                       CleanupSweepRoutine, ExtractPackageRoutine,
                        RemoveCompletedIngestsRoutine,
                        RemoveCompletedTransfersRoutine,
-                       RestructurePackageRoutine, StartPackageRoutine)
+                       RestructurePackageRoutine, StartPackageRoutine,
+                       StreamAssemblePackageRoutine)
 
 data_fixture_dir = join(settings.BASE_DIR, 'fixtures', 'json')
 bag_fixture_dir = join(settings.BASE_DIR, 'fixtures', 'bags')
@@ -50,6 +72,26 @@ class CsvCreatorTests(TestCase):
         self.assertEqual(
             created_csv, "CSV {} created.".format(join(self.tmp_dir, 'aurora_example', 'data', 'metadata', 'rights.csv')))
 
+    @patch('amclient.AMClient.validate_csv')
+    def test_create_rights_csv_rows(self, mock_validate):
+        """Asserts a row is written for every file in nested directories and each rights statement."""
+        mock_validate.return_value = {"valid": "true"}
+        bag_path = join(self.tmp_dir, "digitization_example")
+        makedirs(join(bag_path, "data", "objects", "nested", "deeper"))
+        for index in range(CsvCreator.chunk_size + 1):
+            with open(join(bag_path, "data", "objects", "nested", "deeper", f"{index}.txt"), "w") as f:
+                f.write(str(index))
+        with open(join(csv_fixture_dir, "digitization_example.json"), 'r') as json_file:
+            json_data = json.load(json_file)
+        csv_creator = CsvCreator("1.13.1", ArchivematicaClientMixin().get_client("digitization"))
+        csv_creator.create_rights_csv(bag_path, json_data["bag_data"]["rights_statements"])
+        file_paths = [relpath(join(dirpath, f), bag_path) for dirpath, _, files in walk(join(bag_path, "data", "objects")) for f in files]
+        with open(join(bag_path, "data", "metadata", "rights.csv"), "r") as csvfile:
+            rows = list(csv.reader(csvfile))
+        self.assertEqual(rows[0], csv_creator.field_names)
+        self.assertEqual(len(rows) - 1, len(file_paths) * len(csv_creator.get_row_tails()))
+        self.assertEqual(set(row[0] for row in rows[1:]), set(file_paths))
+
     @patch('amclient.AMClient.validate_csv')
     def test_get_rights_rows(self, mock_validate):
         for am_version in ["1.12", "1.13.1"]:
@@ -79,6 +121,50 @@ class CsvCreatorTests(TestCase):
                 json_data["bag_data"]["rights_statements"])
         self.assertIn(message, str(err.exception))
 
+    def test_validate_rights_csv_locally(self):
+        """Asserts invalid rights CSVs are rejected without contacting Archivematica."""
+        header = ",".join(RightsCsvValidator.required_columns)
+        valid_row = "data/objects/sample.txt,Copyright,copyrighted,2018-09-19,us,1955,open,,,,publish,disallow,1955-01-01,2031-06-12,,,,"
+        RightsCsvValidator(skip_no_act=True).validate(StringIO("\n".join([header, valid_row])))
+        for rows, skip_no_act, error in [
+                ([header.replace(",grant_act", ""), valid_row], False, "missing columns grant_act"),
+                ([header, valid_row.replace("Copyright", "Contract")], False, "invalid basis Contract"),
+                ([header, valid_row.replace("2018-09-19", "2018-02-30")], False, "invalid determination_date"),
+                ([header, valid_row.replace("publish,disallow", "print,disallow")], False, "invalid act print"),
+                ([header, valid_row.replace("publish,disallow", ",")], True, "act is required")]:
+            with self.assertRaises(Exception) as err:
+                RightsCsvValidator(skip_no_act).validate(StringIO("\n".join(rows)))
+            self.assertIn(error, str(err.exception))
+        RightsCsvValidator(skip_no_act=False).validate(StringIO("\n".join([header, valid_row.replace("publish,disallow", ",")])))
+
+    @patch('amclient.AMClient.validate_csv')
+    def test_remote_validation(self, mock_validate):
+        """Asserts remote validation uploads the whole CSV, a sample or nothing as configured."""
+        mock_validate.return_value = {"valid": "true"}
+        with open(join(csv_fixture_dir, "aurora_example.json"), 'r') as json_file:
+            rights_statements = json.load(json_file)["bag_data"]["rights_statements"]
+        bag_path = join(self.tmp_dir, "aurora_example")
+        for index in range(CsvCreator.sample_rows):
+            with open(join(bag_path, "data", "objects", f"{index}.txt"), "w") as f:
+                f.write(str(index))
+        uploaded_rows = {}
+        for remote_validation in ["all", "sample", "none"]:
+            mock_validate.reset_mock()
+            mock_validate.side_effect = lambda type, file_obj: uploaded_rows.update(
+                {remote_validation: len(list(csv.reader(file_obj)))}) or {"valid": "true"}
+            csv_filepath = join(bag_path, "data", "metadata", "rights.csv")
+            if isfile(csv_filepath):
+                shutil.rmtree(join(bag_path, "data", "metadata"))
+            CsvCreator("1.13.1", ArchivematicaClientMixin().get_client("aurora"), remote_validation).create_rights_csv(
+                bag_path, rights_statements)
+            with open(csv_filepath, "r") as csvfile:
+                total_rows = len(list(csv.reader(csvfile)))
+            if remote_validation == "none":
+                mock_validate.assert_not_called()
+        self.assertEqual(uploaded_rows["all"], total_rows)
+        self.assertEqual(uploaded_rows["sample"], CsvCreator.sample_rows + 1)
+        self.assertLess(uploaded_rows["sample"], total_rows)
+
     def tearDown(self):
         if isdir(self.tmp_dir):
             shutil.rmtree(self.tmp_dir)
@@ -143,6 +229,111 @@ class RoutineTests(TestCase):
             message, sip_id = routine.run()
         self.assertIn(expected_exception, str(exc.exception))
 
+    def test_routine_concurrency(self):
+        """Asserts SIPs are claimed only once and concurrency limits are respected."""
+        self.set_process_status(SIP.CREATED)
+        routine = ExtractPackageRoutine()
+        in_process = SIP.objects.first()
+        in_process.process_status = SIP.EXTRACTING
+        in_process.save()
+
+        with patch.dict(settings.ROUTINE_CONCURRENCY, {"extract": 1}):
+            message, sip_id = routine.run()
+            self.assertEqual(message, "Service currently running")
+            self.assertEqual(sip_id, None)
+
+        with patch.dict(settings.ROUTINE_CONCURRENCY, {"extract": 2}):
+            claimed = routine.claim_sip()
+            self.assertNotEqual(claimed.pk, in_process.pk)
+            self.assertEqual(claimed.process_status, SIP.EXTRACTING)
+            self.assertEqual(routine.claim_sip(), None)
+            self.assertEqual(SIP.objects.filter(process_status=SIP.EXTRACTING).count(), 2)
+
+    @patch("sip_assembly.routines.ExtractPackageRoutine.process_sip")
+    def test_origin_scheduling(self, mock_process):
+        """Asserts SIPs are selected in rotation by origin and origin limits are respected."""
+        mock_process.return_value = "foo"
+        self.set_process_status(SIP.CREATED)
+        for sip in SIP.objects.order_by("pk")[3:]:
+            sip.origin = "digitization"
+            sip.save()
+        processed_origins = []
+        for _ in range(4):
+            _, sip_id = ExtractPackageRoutine().run()
+            processed_origins.append(SIP.objects.get(bag_identifier=sip_id[0]).origin)
+        self.assertEqual(processed_origins, ["aurora", "digitization", "aurora", "digitization"])
+
+        self.set_process_status(SIP.CREATED)
+        in_process = SIP.objects.filter(origin="aurora").first()
+        in_process.process_status = SIP.EXTRACTING
+        in_process.save()
+        with patch.dict(settings.ROUTINE_CONCURRENCY, {"extract": 3}), \
+                patch.dict(settings.ARCHIVEMATICA_ORIGINS["aurora"], {"max_concurrent_sips": 1}):
+            candidate_origins = set(origin for _, origin in ExtractPackageRoutine().get_candidates())
+            self.assertEqual(candidate_origins, {"digitization"})
+
+    @patch("sip_assembly.routines.ExtractPackageRoutine.process_sip")
+    def test_routine_batch(self, mock_process):
+        """Asserts routines process multiple SIPs up to a limit or time budget."""
+        mock_process.return_value = "foo"
+        self.set_process_status(SIP.CREATED)
+        total_sips = SIP.objects.count()
+
+        message, sip_ids = ExtractPackageRoutine().run(limit=2)
+        self.assertEqual(len(sip_ids), 2)
+        self.assertEqual(message, "2 SIPs processed: foo")
+        self.assertEqual(SIP.objects.filter(process_status=SIP.EXTRACTED).count(), 2)
+
+        message, sip_ids = ExtractPackageRoutine().run(limit=total_sips, max_seconds=0.000001)
+        self.assertEqual(len(sip_ids), 1)
+
+        message, sip_ids = ExtractPackageRoutine().run(limit=total_sips)
+        self.assertEqual(len(sip_ids), total_sips - 3)
+        self.assertEqual(SIP.objects.filter(process_status=SIP.EXTRACTED).count(), total_sips)
+
+        message, sip_ids = ExtractPackageRoutine().run(limit=total_sips)
+        self.assertEqual(message, "No SIPs to extract.")
+        self.assertEqual(sip_ids, None)
+
+        self.set_process_status(SIP.CREATED)
+        self.assertEqual(ExtractPackageRoutine().run(limit=0), ("No SIPs to extract.", None))
+
+    @patch("sip_assembly.routines.ExtractPackageRoutine.process_sip")
+    def test_routine_batch_error(self, mock_process):
+        """Asserts SIPs processed before an error in a batch are listed in the exception."""
+        mock_process.side_effect = ["foo", Exception("bar")]
+        self.set_process_status(SIP.CREATED)
+        with self.assertRaises(Exception) as e:
+            ExtractPackageRoutine().run(limit=3)
+        message, identifiers = e.exception.args
+        self.assertEqual(message, "1 SIPs processed before error: bar")
+        self.assertEqual(
+            list(SIP.objects.filter(process_status=SIP.EXTRACTED).values_list("bag_identifier", flat=True)),
+            identifiers["processed"])
+        self.assertEqual(SIP.objects.get(bag_identifier=identifiers["failed"]).process_status, SIP.CREATED)
+
+    @patch("sip_assembly.routines.ArchivematicaClientMixin.warm_processing_configs")
+    @patch("sip_assembly.routines.CleanupPackageRequester.process_sip")
+    @patch("sip_assembly.routines.StartPackageRoutine.process_sip")
+    @patch("sip_assembly.routines.AssemblePackageRoutine.process_sip")
+    @patch("sip_assembly.routines.RestructurePackageRoutine.process_sip")
+    @patch("sip_assembly.routines.ExtractPackageRoutine.process_sip")
+    def test_run_pipeline(self, *mocks):
+        """Asserts the pipeline worker passes a SIP through every routine."""
+        *mock_processes, mock_warm = mocks
+        mock_warm.return_value = ("Processing configurations cached.", [])
+        for mock_process in mock_processes:
+            mock_process.return_value = "foo"
+        self.set_process_status(SIP.CREATED)
+        # Closing connections would end the test case's transaction.
+        with patch("sip_assembly.management.commands.run_pipeline.close_old_connections") as mock_close:
+            call_command("run_pipeline", "--once", stdout=StringIO())
+        mock_close.assert_called_once()
+        self.assertEqual(SIP.objects.filter(process_status=SIP.CLEANED_UP).count(), 1)
+        for mock_process in mock_processes:
+            mock_process.assert_called_once()
+        mock_warm.assert_called_once()
+
     def test_extract_sip(self):
         """Asserts the ExtractPackageRoutine extracts the package and sets the bag_path."""
         self.set_process_status(SIP.CREATED)
@@ -153,6 +344,70 @@ class RoutineTests(TestCase):
             self.assertTrue(isdir(sip.bag_path))
             self.assertEqual(sip.bag_path, join(settings.TMP_DIR, sip.bag_identifier))
 
+    def test_extract_sip_without_streaming(self):
+        """Asserts SIPs are extracted when copied to the temporary directory first."""
+        self.set_process_status(SIP.CREATED)
+        with patch.object(settings, "STREAMING_EXTRACTION", False):
+            message, sip_id = ExtractPackageRoutine().run()
+        self.assertEqual(message, "SIP extracted.")
+        self.assertFalse(isfile(join(settings.TMP_DIR, f"{sip_id[0]}.tar.gz")))
+        self.assertTrue(isdir(join(settings.TMP_DIR, sip_id[0])))
+
+    def test_extract_permissions(self):
+        """Asserts permissions set during extraction match those set by recursive_chmod."""
+        bag_dir = join(settings.TMP_DIR, "synthetic", "synthetic")
+        for i in range(500):
+            file_dir = join(bag_dir, "data", str(i % 10))
+            makedirs(file_dir, exist_ok=True)
+            with open(join(file_dir, f"{i}.txt"), "w") as f:
+                f.write(str(i))
+        tar_path = join(settings.SRC_DIR, "synthetic.tar.gz")
+        with tarfile.open(tar_path, "w:gz") as tar:
+            tar.add(bag_dir, arcname="synthetic", filter=lambda m: setattr(m, "mode", 0o600) or m)
+        extracted_modes = []
+        for extract_dir, streaming in [(join(settings.TMP_DIR, "streaming"), True), (join(settings.TMP_DIR, "walk"), False)]:
+            makedirs(extract_dir)
+            if streaming:
+                extracted = routines_helpers.stream_extract(tar_path, "synthetic", extract_dir, mode=0o775)
+            else:
+                extracted = routines_helpers.stream_extract(tar_path, "synthetic", extract_dir)
+                routines_helpers.recursive_chmod(extracted, 0o775)
+            modes = {}
+            for root, dirs, files in walk(extracted):
+                for name in dirs + files:
+                    path = join(root, name)
+                    modes[relpath(path, extracted)] = stat.S_IMODE(lstat(path).st_mode)
+            extracted_modes.append(modes)
+        self.assertEqual(len(extracted_modes[0]), 511)
+        self.assertEqual(extracted_modes[0], extracted_modes[1])
+        self.assertEqual(set(extracted_modes[0].values()), {0o775})
+
+    def test_stream_extract(self):
+        """Asserts streaming extraction leaves the source archive in place and rejects unsafe paths."""
+        sip = SIP.objects.first()
+        src_path = join(settings.SRC_DIR, f"{sip.bag_identifier}.tar.gz")
+        extracted = routines_helpers.stream_extract(src_path, sip.bag_identifier, settings.TMP_DIR)
+        self.assertTrue(isfile(join(extracted, "bag-info.txt")))
+        self.assertTrue(isfile(src_path))
+
+        unsafe_path = join(settings.SRC_DIR, "unsafe.tar.gz")
+        with tarfile.open(unsafe_path, "w:gz") as tar:
+            tar.add(src_path, arcname="../unsafe.txt")
+        with self.assertRaises(Exception) as exc:
+            routines_helpers.stream_extract(unsafe_path, "unsafe", settings.TMP_DIR)
+        self.assertIn("outside extraction directory", str(exc.exception))
+
+        for link_type, linkname in [(tarfile.SYMTYPE, "../../unsafe.txt"), (tarfile.LNKTYPE, "../unsafe.txt")]:
+            link = tarfile.TarInfo("unsafe/link")
+            link.type = link_type
+            link.linkname = linkname
+            with tarfile.open(unsafe_path, "w:gz") as tar:
+                tar.addfile(link)
+            with self.assertRaises(Exception) as exc:
+                routines_helpers.stream_extract(unsafe_path, "unsafe", settings.TMP_DIR)
+            self.assertIn("link outside extraction directory", str(exc.exception))
+            self.assertFalse(lexists(join(settings.TMP_DIR, "unsafe", "link")))
+
     @patch("sip_assembly.routines.AMClient.get_processing_config")
     @patch('amclient.AMClient.validate_csv')
     def test_restructure_sip(self, mock_validate, mock_processing_config):
@@ -179,6 +434,90 @@ class RoutineTests(TestCase):
             self.assertTrue(isfile(join(sip.bag_path, "processingMCP.xml")))
             self.assert_files_not_removed(sip)
 
+    @patch("sip_assembly.routines.AMClient.get_processing_config")
+    def test_processing_config_cache(self, mock_processing_config):
+        """Asserts processing configurations are cached per origin, refreshed after the TTL and kept through outages."""
+        mock_processing_config.return_value = "<processingMCP/>"
+        mixin = ArchivematicaClientMixin()
+        for _ in range(2):
+            self.assertEqual(mixin.get_processing_config("aurora", mixin.get_client("aurora")), "<processingMCP/>")
+        mock_processing_config.assert_called_once()
+        message, origins = mixin.warm_processing_configs()
+        self.assertEqual(origins, list(settings.ARCHIVEMATICA_ORIGINS))
+        self.assertEqual(mock_processing_config.call_count, len(settings.ARCHIVEMATICA_ORIGINS))
+
+        mock_processing_config.return_value = 404
+        with patch.object(settings, "PROCESSING_CONFIG_TTL", 0), \
+                self.assertLogs("sip_assembly.routines_helpers", level="WARNING") as logs:
+            self.assertEqual(mixin.get_processing_config("aurora", mixin.get_client("aurora")), "<processingMCP/>")
+        self.assertIn("using cached copy", logs.output[0])
+        _, removed = mixin.invalidate_processing_configs("aurora")
+        self.assertEqual(len(removed), 1)
+        with self.assertRaises(Exception):
+            mixin.get_processing_config("aurora", mixin.get_client("aurora"))
+
+        out = StringIO()
+        call_command("processing_configs", "clear", stdout=out)
+        self.assertIn("Processing configuration cache cleared.", out.getvalue())
+        self.assertEqual(listdir(join(settings.CACHE_DIR, "processing_configs")), [])
+
+    def test_rewrite_manifests(self):
+        """Asserts manifests are valid after restructuring and only new files are hashed."""
+        sip = SIP.objects.first()
+        bag_path = routines_helpers.stream_extract(
+            join(settings.SRC_DIR, f"{sip.bag_identifier}.tar.gz"), sip.bag_identifier, settings.TMP_DIR)
+        routines_helpers.move_objects_dir(bag_path)
+        routines_helpers.create_structure(bag_path)
+        with open(join(bag_path, "data", "metadata", "rights.csv"), "w") as f:
+            f.write("file,basis")
+        with patch("sip_assembly.routines_helpers.get_checksums", wraps=routines_helpers.get_checksums) as mock_checksums:
+            routines_helpers.rewrite_manifests(bag_path)
+        mock_checksums.assert_called_once()
+        self.assertEqual(mock_checksums.call_args[0][0], join(bag_path, "data", "metadata", "rights.csv"))
+        bag = bagit.Bag(bag_path)
+        bag.validate()
+        self.assertTrue(all(path.startswith(("data/objects/", "data/metadata/")) for path in bag.payload_entries()))
+
+    def test_validate_bag(self):
+        """Asserts bags are validated in parallel and checksum mismatches are reported."""
+        sip = SIP.objects.first()
+        bag_path = routines_helpers.stream_extract(
+            join(settings.SRC_DIR, f"{sip.bag_identifier}.tar.gz"), sip.bag_identifier, settings.TMP_DIR)
+        self.assertTrue(routines_helpers.validate_bag(bag_path, workers=4))
+        payload_file = max(
+            [join(bag_path, path) for path in bagit.Bag(bag_path).payload_entries()], key=getsize)
+        with open(payload_file, "rb") as f:
+            contents = f.read()
+        with open(payload_file, "wb") as f:
+            f.write(bytes([(contents[0] + 1) % 256]) + contents[1:])
+        with self.assertRaises(bagit.BagValidationError) as exc:
+            routines_helpers.validate_bag(bag_path, workers=4)
+        self.assertIsInstance(exc.exception.details[0], bagit.ChecksumMismatch)
+
+    def test_checksum_cache(self):
+        """Asserts cached checksums survive renames but not changes to file contents."""
+        sip = SIP.objects.first()
+        bag_path = routines_helpers.stream_extract(
+            join(settings.SRC_DIR, f"{sip.bag_identifier}.tar.gz"), sip.bag_identifier, settings.TMP_DIR)
+        cache_path = join(settings.TMP_DIR, "checksums.json")
+        cache = routines_helpers.ChecksumCache(cache_path)
+        routines_helpers.validate_bag(bag_path, cache=cache)
+        cache.save()
+        algorithms = bagit.Bag(bag_path).algorithms
+        routines_helpers.move_objects_dir(bag_path)
+
+        cache = routines_helpers.ChecksumCache(cache_path)
+        moved_files = [join(root, f) for root, _, files in walk(join(bag_path, "data", "objects")) for f in files]
+        self.assertTrue(moved_files)
+        for file_path in moved_files:
+            self.assertIsNotNone(cache.get(file_path, algorithms))
+        with open(moved_files[0], "a") as f:
+            f.write("changed")
+        self.assertIsNone(cache.get(moved_files[0], algorithms))
+
+        cache.clear()
+        self.assertFalse(isfile(cache_path))
+
     def test_assemble_sip(self):
         """Asserts that the AssemblePackageView creates the expected tarfile."""
         self.set_process_status(SIP.CREATED)
@@ -190,6 +529,147 @@ class RoutineTests(TestCase):
         for sip in SIP.objects.filter(process_status=SIP.ASSEMBLED):
             self.assertEqual(join(settings.DEST_DIR, f"{sip.bag_identifier}.tar.gz"), sip.bag_path)
             self.assertTrue(isfile(sip.bag_path))
+        self.assertEqual(listdir(settings.DEST_DIR), [f"{sip_id[0]}.tar.gz"])
+
+    def test_assemble_uncompressed_sip(self):
+        """Asserts packages are created and cleaned up in the format configured for their origin."""
+        self.set_process_status(SIP.CREATED)
+        _, sip_id = ExtractPackageRoutine().run()
+        self.set_process_status(SIP.RESTRUCTURED)
+        with patch.dict(settings.ARCHIVEMATICA_ORIGINS["aurora"], {"package_format": "tar"}):
+            AssemblePackageRoutine().run()
+        sip = SIP.objects.get(bag_identifier=sip_id[0])
+        self.assertEqual(sip.bag_path, join(settings.DEST_DIR, f"{sip.bag_identifier}.tar"))
+        with tarfile.open(sip.bag_path, "r:") as tar:
+            self.assertIn(f"{sip.bag_identifier}/bag-info.txt", tar.getnames())
+        message, _ = CleanupPackageRoutine(sip.bag_identifier).run()
+        self.assertEqual(message, "Transfer removed.")
+        self.assertFalse(isfile(sip.bag_path))
+
+        for level in [0, 9]:
+            with patch.dict(settings.ARCHIVEMATICA_ORIGINS["aurora"], {"compression_level": level}):
+                self.assertEqual(AssemblePackageRoutine().get_package_options(sip)["compresslevel"], level)
+        for level in [-1, 10, None]:
+            with patch.dict(settings.ARCHIVEMATICA_ORIGINS["aurora"], {"compression_level": level}), \
+                    self.assertRaises(Exception):
+                AssemblePackageRoutine().get_package_options(sip)
+
+    @patch("sip_assembly.routines_helpers.ParallelGzipWriter.write")
+    def test_assemble_sip_failure(self, mock_write):
+        """Asserts a failed package is not left in the destination directory and the bag is preserved."""
+        mock_write.side_effect = OSError("No space left on device")
+        self.set_process_status(SIP.CREATED)
+        ExtractPackageRoutine().run()
+        self.set_process_status(SIP.RESTRUCTURED)
+        with patch.object(settings, "COMPRESSION_THREADS", 2), self.assertRaises(Exception):
+            AssemblePackageRoutine().run()
+        self.assertEqual(listdir(settings.DEST_DIR), [])
+        self.assertEqual(SIP.objects.filter(process_status=SIP.RESTRUCTURED).count(), SIP.objects.count())
+        for sip in SIP.objects.all():
+            if sip.bag_path.startswith(settings.TMP_DIR):
+                self.assertTrue(isdir(sip.bag_path))
+
+    @patch("sip_assembly.routines.AMClient.get_processing_config")
+    @patch('amclient.AMClient.validate_csv')
+    def test_stream_assemble_sip(self, mock_validate, mock_processing_config):
+        """Asserts SIPs from streaming origins are restructured and packaged without being extracted."""
+        with open(join(processing_config_fixture_dir, "processingMCP.xml"), "r") as config_file:
+            mock_processing_config.return_value = config_file.read()
+        mock_validate.return_value = {"valid": "true"}
+        self.set_process_status(SIP.CREATED)
+        SIP.objects.update(origin="aurora")
+        with patch.dict(settings.ARCHIVEMATICA_ORIGINS["aurora"], {"streaming_assembly": True}):
+            self.assertEqual(ExtractPackageRoutine().run(), ("No SIPs to extract.", None))
+            message, sip_id = StreamAssemblePackageRoutine().run()
+        self.assertEqual(message, "SIP assembled.")
+        sip = SIP.objects.get(bag_identifier=sip_id[0])
+        self.assertEqual(sip.process_status, SIP.ASSEMBLED)
+        self.assertEqual(sip.bag_path, join(settings.DEST_DIR, f"{sip.bag_identifier}.tar.gz"))
+        self.assertEqual(listdir(settings.TMP_DIR), [])
+        with tarfile.open(sip.bag_path, "r:gz") as tar:
+            tar.extractall(settings.TMP_DIR)
+        bag = bagit.Bag(join(settings.TMP_DIR, sip.bag_identifier))
+        bag.validate()
+        self.assertEqual(sip.bag_identifier, bag.info["Internal-Sender-Identifier"])
+        self.assertTrue(isfile(join(bag.path, "processingMCP.xml")))
+        self.assertTrue(isdir(join(bag.path, "data", "objects")))
+        self.assertEqual(
+            isfile(join(bag.path, "data", "metadata", "rights.csv")), bool(sip.data["rights_statements"]))
+
+    def test_stream_manifest_algorithms(self):
+        """Asserts payload files are hashed and validated with the algorithms of every manifest, and links are moved."""
+        sip = SIP.objects.first()
+        bag_path = routines_helpers.stream_extract(
+            join(settings.SRC_DIR, f"{sip.bag_identifier}.tar.gz"), sip.bag_identifier, join(settings.TMP_DIR, "src"))
+        target = sorted(f for f in listdir(join(bag_path, "data")) if isfile(join(bag_path, "data", f)))[0]
+        link(join(bag_path, "data", target), join(bag_path, "data", "zz-link"))
+        bag = bagit.Bag(bag_path)
+        bag.algorithms = ["md5", "sha256"]
+        bag.save(manifests=True)
+
+        def create_source(path):
+            with tarfile.open(path, "w:gz") as tar:
+                tar.add(bag_path, arcname=sip.bag_identifier, recursive=False)
+                for name in ["manifest-md5.txt", "data"] + sorted(set(listdir(bag_path)) - {"manifest-md5.txt", "data"}):
+                    tar.add(join(bag_path, name), arcname=join(sip.bag_identifier, name))
+            return path
+
+        src_path = create_source(join(settings.TMP_DIR, f"{sip.bag_identifier}.tar.gz"))
+        dest_dir = join(settings.TMP_DIR, "dest")
+        makedirs(dest_dir)
+        with patch("sip_assembly.package_streamer.HashingReader", wraps=HashingReader) as mock_reader:
+            package_path = PackageStreamer(src_path, sip.bag_identifier, settings.TMP_DIR).create_package(
+                dest_dir, {}, "<processingMCP/>")
+        self.assertTrue(mock_reader.call_args_list)
+        for args, _ in mock_reader.call_args_list:
+            self.assertEqual(list(args[1]), ["md5", "sha256"])
+        with tarfile.open(package_path, "r:gz") as tar:
+            hard_link = tar.getmember(f"{sip.bag_identifier}/data/objects/zz-link")
+            self.assertTrue(hard_link.islnk())
+            self.assertEqual(hard_link.linkname, f"{sip.bag_identifier}/data/objects/{target}")
+            tar.extractall(dest_dir)
+        bag = bagit.Bag(join(dest_dir, sip.bag_identifier))
+        bag.validate()
+        self.assertEqual(sorted(bag.algorithms), ["md5", "sha256"])
+
+        with open(join(bag_path, "manifest-sha256.txt"), "r") as f:
+            lines = f.readlines()
+        with open(join(bag_path, "manifest-sha256.txt"), "w") as f:
+            f.writelines(["0" * 64 + lines[0][64:]] + lines[1:])
+        src_path = create_source(src_path)
+        with self.assertRaises(Exception) as exc:
+            PackageStreamer(src_path, sip.bag_identifier, settings.TMP_DIR).create_package(
+                dest_dir, {}, "<processingMCP/>")
+        self.assertIn("{} sha256 validation failed".format(lines[0][64:].strip()), exc.exception.args[1])
+
+    def test_parallel_compression(self):
+        """Asserts parallel compression produces an archive equivalent to single-threaded compression."""
+        sip = SIP.objects.first()
+        bag_path = routines_helpers.stream_extract(
+            join(settings.SRC_DIR, f"{sip.bag_identifier}.tar.gz"), sip.bag_identifier, settings.TMP_DIR)
+        with open(join(bag_path, "data", "large.txt"), "w") as f:
+            f.write(" ".join(str(random.random()) for _ in range(500000)))
+        archives = {}
+        for threads in [1, 4]:
+            threads_path = join(settings.TMP_DIR, str(threads), sip.bag_identifier)
+            shutil.copytree(bag_path, threads_path)
+            tar_path = routines_helpers.create_targz_package(threads_path, threads)
+            self.assertFalse(isdir(threads_path))
+            with tarfile.open(tar_path, "r:gz") as tar:
+                archives[threads] = {
+                    m.name: tar.extractfile(m).read() if m.isfile() else None for m in tar.getmembers()}
+        self.assertEqual(archives[1], archives[4])
+
+    def test_parallel_compression_error(self):
+        """Asserts an error while compressing propagates without the end of the stream being written."""
+        output = BytesIO()
+        with self.assertRaises(OSError):
+            with ParallelGzipWriter(output, threads=2) as gz:
+                gz.write(b"foo" * ParallelGzipWriter.block_size)
+                raise OSError("No space left on device")
+        self.assertTrue(gz.closed)
+        with self.assertRaises(EOFError):
+            gzip.decompress(output.getvalue())
 
     def test_cleanup_sip(self):
         """Asserts that the CleanupPackageRoutine removes binaries and does not throw
@@ -204,7 +684,40 @@ class RoutineTests(TestCase):
             message, _ = CleanupPackageRoutine(sip.bag_identifier).run()
             self.assertEqual(message, "Transfer was not found.")
 
-    @patch("sip_assembly.routines.requests.post")
+        shutil.rmtree(settings.DEST_DIR)
+        shutil.copytree(bag_fixture_dir, settings.DEST_DIR)
+        identifiers = list(SIP.objects.values_list("bag_identifier", flat=True)) + ["foo"]
+        message, removed = CleanupPackageRoutine(identifiers).run()
+        self.assertEqual(message, "{} of {} transfers removed.".format(len(identifiers) - 1, len(identifiers)))
+        self.assertEqual(removed, identifiers[:-1])
+        self.assertEqual(0, len(listdir(settings.DEST_DIR)))
+
+    def test_cleanup_sweep(self):
+        """Asserts the CleanupSweepRoutine only removes packages for SIPs past the status and age."""
+        shutil.rmtree(settings.DEST_DIR)
+        shutil.copytree(bag_fixture_dir, settings.DEST_DIR)
+        sips = list(SIP.objects.all())
+        SIP.objects.update(process_status=SIP.CLEANED_UP, last_modified=timezone.now() - timedelta(days=30))
+        SIP.objects.filter(pk=sips[0].pk).update(process_status=SIP.CLEANING_UP)
+        SIP.objects.filter(pk=sips[1].pk).update(last_modified=timezone.now())
+        sizes = {sip.bag_identifier: getsize(join(settings.DEST_DIR, "{}.tar.gz".format(sip.bag_identifier))) for sip in sips}
+
+        for min_status in [SIP.CREATED, SIP.ASSEMBLED, SIP.STARTED, SIP.CLEANING_UP]:
+            with self.assertRaises(Exception):
+                CleanupSweepRoutine(min_status=min_status)
+        message, removed = CleanupSweepRoutine(min_age=86400, dry_run=True).run()
+        self.assertEqual(len(removed), len(sips) - 2)
+        self.assertEqual(len(listdir(settings.DEST_DIR)), len(sips))
+
+        out = StringIO()
+        call_command("cleanup_sweep", "--min-age", "86400", stdout=out)
+        self.assertIn("{} transfers removed, {} bytes reclaimed.".format(
+            len(removed), sum(sizes[identifier] for identifier in removed)), out.getvalue())
+        self.assertEqual(
+            sorted(listdir(settings.DEST_DIR)),
+            sorted("{}.tar.gz".format(sip.bag_identifier) for sip in sips[:2]))
+
+    @patch("sip_assembly.sessions.requests.Session.post")
     def test_request_cleanup(self, mock_post):
         """Asserts that the CleanupPackageRequester returns expected values and handles exceptions."""
         self.set_process_status(SIP.APPROVED)
@@ -238,16 +751,101 @@ class RoutineTests(TestCase):
         self.assertEqual(sip.process_status, SIP.APPROVED)
 
         self.set_process_status(SIP.ASSEMBLED)
+        SIP.objects.update(origin="aurora", archivematica_started=None)
         last_started = random.choice(SIP.objects.all())
         last_started.process_status = SIP.APPROVED
         last_started.archivematica_uuid = "12345"
+        last_started.archivematica_started = timezone.now()
         last_started.save()
         mock_status.return_value = {'type': 'transfer', 'path': '/var/archivematica/sharedDirectory/currentlyProcessing/59193ace-30c3-4a3b-a656-9232ebc7ce0e.tar.gz', 'directory': '59193ace-30c3-4a3b-a656-9232ebc7ce0e.tar.gz', 'name': '59193ace-30c3-4a3b-a656-9232ebc7ce0e.tar.gz', 'uuid': '1651add2-d21b-445a-abd4-444450648ba9', 'microservice': 'Extract zipped bag transfer', 'status': 'PROCESSING', 'message': 'Fetched status for 1651add2-d21b-445a-abd4-444450648ba9 successfully.'}
         message, sip_id = StartPackageRoutine().run()
-        sip = SIP.objects.get(bag_identifier=sip_id[0])
-        self.assertEqual(message, "Another transfer is processing, waiting until it finishes.")
-        self.assertEqual(len(sip_id), 1)
-        self.assertEqual(sip.process_status, SIP.ASSEMBLED)
+        self.assertEqual(message, "No transfers to start.")
+        self.assertEqual(sip_id, None)
+        self.assertEqual(SIP.objects.filter(process_status=SIP.ASSEMBLED).count(), SIP.objects.count() - 1)
+
+    @patch("sip_assembly.routines.AMClient.get_unit_status")
+    @patch("sip_assembly.routines.AMClient.create_package")
+    def test_max_concurrent_transfers(self, mock_create, mock_status):
+        """Asserts transfers are started up to each origin's limit, skipping saturated origins."""
+        self.set_process_status(SIP.ASSEMBLED)
+        for sip in SIP.objects.order_by("pk")[3:]:
+            sip.origin = "digitization"
+            sip.save()
+        SIP.objects.filter(pk=SIP.objects.order_by("pk")[0].pk).update(
+            process_status=SIP.APPROVED, archivematica_uuid="12345", archivematica_started=timezone.now())
+        mock_create.return_value = {"id": "12345"}
+        mock_status.return_value = {"status": "PROCESSING"}
+        with patch.dict(settings.ARCHIVEMATICA_ORIGINS["aurora"], {"max_concurrent_transfers": 2}), \
+                patch.dict(settings.ARCHIVEMATICA_ORIGINS["digitization"], {"max_concurrent_transfers": 1}):
+            message, sip_ids = StartPackageRoutine().run(limit=SIP.objects.count())
+        self.assertEqual(mock_status.call_count, 1)
+        started = SIP.objects.filter(bag_identifier__in=sip_ids)
+        self.assertEqual(started.filter(origin="aurora").count(), 1)
+        self.assertEqual(started.filter(origin="digitization").count(), 1)
+        self.assertEqual(SIP.objects.filter(process_status=SIP.APPROVED).count(), 3)
+        self.assertEqual(SIP.objects.filter(process_status=SIP.ASSEMBLED).count(), SIP.objects.count() - 3)
+
+    @patch("sip_assembly.routines.AMClient.get_unit_status")
+    def test_transfer_status_errors(self, mock_status):
+        """Asserts status errors only saturate their own origin, and transfers unknown to Archivematica are marked failed."""
+        self.set_process_status(SIP.ASSEMBLED)
+        sips = list(SIP.objects.order_by("pk"))
+        SIP.objects.filter(pk=sips[0].pk).update(
+            process_status=SIP.APPROVED, archivematica_uuid="12345", archivematica_started=timezone.now())
+        SIP.objects.filter(pk__in=[sip.pk for sip in sips[2:4]]).update(origin="digitization")
+        SIP.objects.filter(pk=sips[4].pk).update(origin="foo")
+        response = requests.Response()
+
+        response.status_code = 500
+        mock_status.side_effect = requests.exceptions.HTTPError(response=response)
+        waiting = StartPackageRoutine().get_queryset()
+        self.assertEqual(set(waiting.values_list("origin", flat=True)), {"digitization"})
+        self.assertIsNone(SIP.objects.get(pk=sips[0].pk).archivematica_status)
+
+        response.status_code = 404
+        waiting = StartPackageRoutine().get_queryset()
+        self.assertEqual(set(waiting.values_list("origin", flat=True)), {"aurora", "digitization"})
+        failed = SIP.objects.get(pk=sips[0].pk)
+        self.assertEqual(failed.archivematica_status, "FAILED")
+        self.assertIsNotNone(failed.archivematica_completed)
+
+    @patch("sip_assembly.management.commands.track_archivematica_status.close_old_connections")
+    @patch("sip_assembly.routines.AMClient.get_unit_status")
+    @patch("sip_assembly.routines.AMClient.create_package")
+    def test_track_archivematica_status(self, mock_create, mock_status, mock_close):
+        """Asserts transfer statuses are recorded by the tracker and used when starting transfers."""
+        self.set_process_status(SIP.ASSEMBLED)
+        started = SIP.objects.filter(origin="aurora").first()
+        started.process_status = SIP.APPROVED
+        started.archivematica_uuid = "12345"
+        started.archivematica_started = timezone.now()
+        started.save()
+        mock_status.return_value = {"status": "PROCESSING"}
+        call_command("track_archivematica_status", "--once", "--origin", "aurora", stdout=StringIO())
+        started.refresh_from_db()
+        self.assertEqual(started.archivematica_status, "PROCESSING")
+        self.assertIsNotNone(started.archivematica_status_checked)
+        self.assertIsNone(started.archivematica_completed)
+
+        mock_status.reset_mock()
+        SIP.objects.exclude(pk=started.pk).update(origin="aurora")
+        message, _ = StartPackageRoutine().run()
+        self.assertEqual(message, "No transfers to start.")
+        mock_status.assert_not_called()
+        mock_create.assert_not_called()
+
+        mock_status.return_value = {"status": "COMPLETE"}
+        call_command("track_archivematica_status", "--once", "--origin", "aurora", stdout=StringIO())
+        started.refresh_from_db()
+        self.assertEqual(started.archivematica_status, "COMPLETE")
+        self.assertIsNotNone(started.archivematica_completed)
+        self.assertFalse(ArchivematicaStatusTracker().get_queryset("aurora").exists())
+        self.assertEqual(mock_close.call_count, 2)
+
+        mock_create.return_value = {"id": "67890"}
+        message, sip_id = StartPackageRoutine().run()
+        self.assertEqual(message, "Transfer started.")
+        self.assertIsNotNone(SIP.objects.get(bag_identifier=sip_id[0]).archivematica_started)
 
     @patch("sip_assembly.routines.AMClient.close_completed_transfers")
     @patch("sip_assembly.routines.AMClient.close_completed_ingests")
@@ -268,12 +866,188 @@ class RoutineTests(TestCase):
         self.assertIn("Error removing ingests from Archivematica dashboard", str(e.exception))
         self.assertIn("12345", str(e.exception))
 
+    @patch("sip_assembly.routines.ArchivematicaClientMixin.close_completed")
+    def test_remove_completed_concurrently(self, mock_close):
+        """Asserts dashboards are cleaned up at the same time and failures do not discard other results."""
+        origins = list(settings.ARCHIVEMATICA_ORIGINS)
+        barrier = threading.Barrier(len(origins), timeout=5)
+
+        def close_completed(origin, type, failing=None):
+            barrier.wait()
+            if origin == failing:
+                raise Exception("Connection refused")
+            return {"close_succeeded": [f"{origin}-uuid"]}
+
+        mock_close.side_effect = lambda origin, type: close_completed(origin, type, failing=origins[0])
+        with patch.object(settings, "REMOVE_COMPLETED_WORKERS", len(origins)), self.assertRaises(Exception) as e:
+            RemoveCompletedTransfersRoutine().run()
+        message, results = e.exception.args
+        self.assertEqual(message, "Error removing transfers from Archivematica dashboard")
+        self.assertEqual(results["failed"], {origins[0]: "Connection refused"})
+        self.assertEqual(results["succeeded"], {origin: [f"{origin}-uuid"] for origin in origins[1:]})
+
+        barrier.reset()
+        mock_close.side_effect = close_completed
+        with patch.object(settings, "REMOVE_COMPLETED_WORKERS", len(origins)):
+            _, results = RemoveCompletedIngestsRoutine().run()
+        self.assertEqual(results, {origin: [f"{origin}-uuid"] for origin in origins})
+
     def tearDown(self):
-        for d in [settings.SRC_DIR, settings.TMP_DIR, settings.DEST_DIR]:
+        for d in [settings.SRC_DIR, settings.TMP_DIR, settings.DEST_DIR, settings.CACHE_DIR]:
             if isdir(d):
                 shutil.rmtree(d)
 
 
+@skipUnless(environ.get("RUN_BENCHMARKS"), "Set RUN_BENCHMARKS=1 to run query plan tests.")
+class QueryPlanTests(TestCase):
+    """Asserts SIP queue queries use indexes against a large table."""
+
+    seed_count = 20000
+
+    def setUp(self):
+        origins = list(settings.ARCHIVEMATICA_ORIGINS)
+        SIP.objects.bulk_create([
+            SIP(bag_identifier="sip-{}".format(i),
+                bag_path="/src/sip-{}.tar.gz".format(i),
+                origin=origins[i % len(origins)],
+                process_status=SIP.APPROVED if i % 100 == 0 else SIP.CLEANED_UP,
+                archivematica_uuid="uuid-{}".format(i),
+                data={}) for i in range(self.seed_count)], batch_size=1000)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE {}".format(SIP._meta.db_table))
+
+    def assert_uses_index(self, queryset, *index_names):
+        plan = queryset.explain()
+        self.assertTrue(any(name in plan for name in index_names), plan)
+
+    def test_queue_queries(self):
+        routine = CleanupPackageRequester()
+        self.assert_uses_index(
+            routine.get_queryset().filter(origin="aurora").order_by("created", "pk").values_list("pk", "origin"),
+            "sip_status_created_idx", "sip_origin_status_idx")
+        self.assert_uses_index(
+            SIP.objects.filter(process_status=routine.in_process_status).values_list(
+                "origin").annotate(count=Count("pk")).order_by(),
+            "sip_status_created_idx", "sip_origin_status_idx")
+        self.assert_uses_index(
+            SIP.objects.filter(process_status=routine.in_process_status, origin="aurora"),
+            "sip_origin_status_idx")
+        self.assert_uses_index(SIP.objects.filter(archivematica_uuid="uuid-100"), "sip_archivematica_uuid_idx")
+
+
+class StubArchivematicaHandler(BaseHTTPRequestHandler):
+    """Responds to requests with a processing configuration, or with queued error statuses."""
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.respond(b"<processingMCP/>", "application/xml")
+
+    def do_POST(self):
+        self.server.bodies.append(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        self.respond(b'{"id": "foo"}', "application/json")
+
+    def respond(self, body, content_type):
+        self.server.requests.append(self.command)
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class SessionTests(TestCase):
+    """Tests pooled connections to Archivematica and the cleanup service against a local stub server."""
+
+    fixtures = ["fixtures/initial.json"]
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubArchivematicaHandler)
+        self.server.connections = 0
+        self.server.requests = []
+        self.server.statuses = []
+        self.server.bodies = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        sessions.registry.close()
+        sessions.cleanup_dispatcher.close()
+        base_url = "http://127.0.0.1:{}".format(self.server.server_port)
+        self.patches = [
+            patch.dict(settings.ARCHIVEMATICA_ORIGINS["aurora"], {"baseurl": base_url}),
+            patch.object(settings, "ARCHIVEMATICA_RETRY_BACKOFF", 0),
+            patch.object(settings, "CLEANUP_URL", "{}/cleanup/".format(base_url)),
+            patch.object(settings, "CLEANUP_RETRY_BACKOFF", 0)]
+        for p in self.patches:
+            p.start()
+
+    def test_connection_reuse(self):
+        """Asserts requests from separate clients for the same origin share one connection."""
+        self.assertIsInstance(utils.requests, sessions.PooledRequests)
+        mixin = ArchivematicaClientMixin()
+        for _ in range(3):
+            self.assertEqual(mixin.fetch_processing_config(mixin.get_client("aurora")), "<processingMCP/>")
+        self.assertEqual(self.server.requests, ["GET"] * 3)
+        self.assertEqual(self.server.connections, 1)
+        sessions.registry.install()
+        self.assertEqual(mixin.fetch_processing_config(mixin.get_client("aurora")), "<processingMCP/>")
+        self.assertEqual(self.server.connections, 1)
+
+    def test_retries(self):
+        """Asserts idempotent requests are retried on server errors and other requests are not."""
+        mixin = ArchivematicaClientMixin()
+        self.server.statuses = [503, 502]
+        self.assertEqual(mixin.fetch_processing_config(mixin.get_client("aurora")), "<processingMCP/>")
+        self.assertEqual(self.server.requests, ["GET"] * 3)
+        self.server.requests = []
+        self.server.statuses = [503]
+        client = mixin.get_client("aurora")
+        client.transfer_directory = client.transfer_name = client.transfer_type = "foo"
+        self.assertEqual(client.create_package(), errors.ERR_INVALID_RESPONSE)
+        self.assertEqual(self.server.requests, ["POST"])
+
+    def test_cleanup_requests(self):
+        """Asserts cleanup requests share one connection and are retried on server errors."""
+        SIP.objects.update(process_status=SIP.APPROVED)
+        self.server.statuses = [503]
+        message, processed = CleanupPackageRequester().run(limit=2)
+        self.assertEqual(len(processed), 2)
+        self.assertEqual(self.server.requests, ["POST"] * 3)
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(
+            [json.loads(body) for body in self.server.bodies[1:]],
+            [{"identifier": identifier} for identifier in processed])
+
+    @patch.object(settings, "CLEANUP_BATCH_SIZE", 2)
+    def test_batched_cleanup_requests(self):
+        """Asserts SIPs are sent in batches, and that a failed batch is returned to its previous status."""
+        SIP.objects.update(process_status=SIP.APPROVED)
+        message, processed = CleanupPackageRequester().run()
+        self.assertEqual(message, "Request sent to clean up 2 SIPs.")
+        self.assertEqual(self.server.requests, ["POST"])
+        self.assertEqual(json.loads(self.server.bodies[0]), {"identifiers": processed})
+        self.assertEqual(SIP.objects.filter(process_status=SIP.CLEANED_UP).count(), 2)
+
+        self.server.statuses = [400]
+        with self.assertRaises(Exception) as e:
+            CleanupPackageRequester().run()
+        self.assertEqual(len(e.exception.args[1]), 2)
+        self.assertFalse(SIP.objects.filter(process_status=SIP.CLEANING_UP).exists())
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        sessions.registry.close()
+        sessions.cleanup_dispatcher.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+
 class ViewTests(TestCase):
     """Tests views."""
 
@@ -299,6 +1073,66 @@ class ViewTests(TestCase):
                     settings.SRC_DIR,
                     f"{source_data['identifier']}.tar.gz"))
 
+    def test_bulk_create_sip_view(self):
+        """Asserts SIPs are created in bulk, and that sending them again updates them without resetting their status."""
+        payloads = []
+        for f in sorted(listdir(data_fixture_dir)):
+            with open(join(data_fixture_dir, f), 'r') as json_file:
+                payloads.append(json.load(json_file))
+        response = self.assert_status_code("post", reverse("sip-bulk"), 200, data=payloads + [{"origin": "aurora"}])
+        self.assertEqual(
+            [r["status"] for r in response.data["results"]], ["created"] * len(payloads) + ["invalid"])
+        self.assertEqual(SIP.objects.count(), len(payloads))
+        for payload in payloads:
+            sip = SIP.objects.get(bag_identifier=payload["identifier"])
+            self.assertEqual(sip.data, payload["bag_data"])
+            self.assertEqual(sip.process_status, SIP.CREATED)
+
+        last_modified = timezone.now() - timedelta(days=1)
+        SIP.objects.update(process_status=SIP.APPROVED, last_modified=last_modified)
+        updated = dict(payloads[0], bag_data={"foo": "bar"})
+        response = self.assert_status_code("post", reverse("sip-bulk"), 200, data=[payloads[0], updated])
+        self.assertEqual([r["status"] for r in response.data["results"]], ["skipped", "updated"])
+        sip = SIP.objects.get(bag_identifier=payloads[0]["identifier"])
+        self.assertEqual(sip.data, {"foo": "bar"})
+        self.assertEqual(sip.process_status, SIP.APPROVED)
+        self.assertGreater(sip.last_modified, last_modified)
+        self.assertEqual(SIP.objects.count(), len(payloads))
+        self.assert_status_code("post", reverse("sip-bulk"), 400, data=payloads[0])
+
+    def test_list_sips_view(self):
+        """Asserts SIPs are paged by cursor and filtered without loading their data."""
+        now = timezone.now()
+        SIP.objects.bulk_create([
+            SIP(bag_identifier="sip-{}".format(i),
+                bag_path="/src/sip-{}.tar.gz".format(i),
+                origin="aurora" if i % 2 else "digitization",
+                process_status=SIP.CREATED if i % 3 else SIP.CLEANED_UP,
+                data={"foo": "bar"}) for i in range(7)])
+        for i, sip in enumerate(SIP.objects.order_by("pk")):
+            SIP.objects.filter(pk=sip.pk).update(created=now - timedelta(days=i))
+
+        identifiers = []
+        url = "{}?page_size=3".format(reverse("sip-list"))
+        with CaptureQueriesContext(connection) as queries:
+            while url:
+                response = self.assert_status_code("get", url, 200)
+                identifiers += [sip["bag_identifier"] for sip in response.data["results"]]
+                url = response.data["next"]
+        self.assertEqual(identifiers, ["sip-{}".format(i) for i in range(7)])
+        for query in queries:
+            self.assertNotIn("COUNT(", query["sql"])
+            self.assertNotIn('"data"', query["sql"])
+
+        response = self.assert_status_code(
+            "get", "{}?process_status={}&origin=aurora".format(reverse("sip-list"), SIP.CREATED), 200)
+        self.assertEqual([sip["bag_identifier"] for sip in response.data["results"]], ["sip-1", "sip-5"])
+        response = self.assert_status_code("get", "{}?created_after={}&created_before={}".format(
+            reverse("sip-list"), (now - timedelta(days=3)).date(), (now - timedelta(days=1)).date()), 200)
+        self.assertEqual([sip["bag_identifier"] for sip in response.data["results"]], ["sip-2", "sip-3"])
+        self.assert_status_code("get", "{}?created_after=foo".format(reverse("sip-list")), 400)
+        self.assert_status_code("get", "{}?process_status=foo".format(reverse("sip-list")), 400)
+
     @patch('sip_assembly.routines.StartPackageRoutine.run')
     def test_archivematica_create_view(self, mock_create):
         """Tests view which creates a package in Archivematica."""
@@ -306,6 +1140,16 @@ class ViewTests(TestCase):
         mock_create.assert_called_once()
         self.assertEqual(mock_create.call_count, 1)
 
+    @patch('sip_assembly.routines.StartPackageRoutine.run')
+    def test_batch_routine_view(self, mock_run):
+        """Tests that batch parameters are passed to routines."""
+        mock_run.return_value = ("foo", None)
+        self.assert_status_code("post", reverse("start-sip"), 200)
+        mock_run.assert_called_with(limit=1, max_seconds=None)
+        self.assert_status_code("post", reverse("start-sip"), 200, {"limit": 10, "max_seconds": 30})
+        mock_run.assert_called_with(limit=10, max_seconds=30.0)
+        self.assert_status_code("post", reverse("start-sip"), 500, {"limit": 0})
+
     @patch('sip_assembly.routines.RemoveCompletedTransfersRoutine.run')
     def test_archivematica_close_transfer_view(self, mock_remove):
         """Tests view which closes transfers in Archivematica"""
@@ -340,6 +1184,12 @@ class ViewTests(TestCase):
         self.assert_status_code("post", reverse("assemble-sip"), 200)
         mock_assemble.assert_called_once()
 
+    @patch('sip_assembly.routines.StreamAssemblePackageRoutine.run')
+    def test_stream_assemble_sip_view(self, mock_assemble):
+        """Tests view which restructures and assembles a SIP in a single pass."""
+        self.assert_status_code("post", reverse("stream-assemble-sip"), 200)
+        mock_assemble.assert_called_once()
+
     @patch('sip_assembly.routines.CleanupPackageRoutine.__init__')
     @patch('sip_assembly.routines.CleanupPackageRoutine.run')
     def test_cleanup_view(self, mock_cleanup, mock_init):
@@ -350,12 +1200,111 @@ class ViewTests(TestCase):
         mock_cleanup.assert_called_once()
         mock_init.assert_called_with(identifier)
 
+    @patch('sip_assembly.routines.CleanupSweepRoutine.run')
+    def test_cleanup_sweep_view(self, mock_sweep):
+        """Tests the CleanupSweepView."""
+        mock_sweep.return_value = ("0 transfers removed, 0 bytes reclaimed.", [])
+        self.assert_status_code("post", reverse("cleanup-sweep"), 200, {"min_status": SIP.APPROVED})
+        mock_sweep.assert_called_once()
+
     @patch('sip_assembly.routines.CleanupPackageRequester.run')
     def test_request_cleanup_view(self, mock_request):
         """Tests the CleanupRequestView."""
         self.assert_status_code("post", reverse("request-cleanup"), 200)
         mock_request.assert_called_once()
 
+    @patch('sip_assembly.routines.ArchivematicaClientMixin.invalidate_processing_configs')
+    def test_clear_processing_configs_view(self, mock_invalidate):
+        """Tests view which clears cached processing configurations."""
+        mock_invalidate.return_value = ("Processing configuration cache cleared.", [])
+        self.assert_status_code("post", reverse("clear-processing-configs"), 200)
+        mock_invalidate.assert_called_once_with(None)
+
     def test_health_check_view(self):
         """Tests the health check view."""
         self.assert_status_code("get", reverse("ping"), 200)
+
+
+@skipUnless(environ.get("RUN_BENCHMARKS"), "Set RUN_BENCHMARKS=1 to run benchmarks.")
+class BenchmarkTests(TestCase):
+    """Times optimized code paths against the paths they replace on synthetic bags."""
+
+    def setUp(self):
+        self.bench_dir = join(settings.TMP_DIR, "benchmarks")
+        makedirs(self.bench_dir, exist_ok=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.bench_dir)
+
+    def create_bag(self, name, file_count, file_size):
+        """Creates a bag of files containing compressible random data."""
+        bag_path = join(self.bench_dir, name)
+        makedirs(bag_path)
+        for i in range(file_count):
+            with open(join(bag_path, "{}.txt".format(i)), "w") as f:
+                f.write(random.randbytes(file_size // 2).hex())
+        bagit.make_bag(bag_path, checksums=["sha256"])
+        return bag_path
+
+    def timed(self, label, func, size):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        print("\n{}: {:.2f}s ({:.1f} MiB/s)".format(label, elapsed, size / elapsed / 1024 ** 2))
+        return elapsed
+
+    def test_compression_throughput(self):
+        """Compares single-threaded tarfile compression with ParallelGzipWriter."""
+        file_count, file_size = 32, 2 * 1024 * 1024
+        threads = max(cpu_count() or 1, 2)
+        durations = {}
+        for label, package_threads in [("tarfile", 1), ("ParallelGzipWriter x{}".format(threads), threads)]:
+            bag_path = self.create_bag(str(package_threads), file_count, file_size)
+            durations[package_threads] = self.timed(
+                "Compression with {}".format(label),
+                partial(routines_helpers.create_targz_package, bag_path, package_threads),
+                file_count * file_size)
+        if (cpu_count() or 1) > 1:
+            self.assertLess(durations[threads], durations[1])
+
+    def test_checksum_throughput(self):
+        """Compares bagit's single-threaded validation with validate_bag using a thread pool."""
+        file_count, file_size = 2000, 64 * 1024
+        workers = max(cpu_count() or 1, 2)
+        bag_path = self.create_bag("checksums", file_count, file_size)
+        serial = self.timed(
+            "Validation with bagit", bagit.Bag(bag_path).validate, file_count * file_size)
+        parallel = self.timed(
+            "Validation with validate_bag x{}".format(workers),
+            partial(routines_helpers.validate_bag, bag_path, workers), file_count * file_size)
+        if (cpu_count() or 1) > 1:
+            self.assertLess(parallel, serial)
+
+    def test_extraction_permissions(self):
+        """Compares the cost of recursive_chmod with setting permissions on each member during extraction.
+
+        tarfile sets the permissions of every extracted member from its
+        `mode` either way, so the only cost of streamed permissions is
+        replacing `mode` on each member before it is extracted.
+        """
+        file_count, file_size = 5000, 1024
+        bag_path = self.create_bag("permissions", file_count, file_size)
+        archive_path = routines_helpers.create_targz_package(bag_path)
+        extracted = routines_helpers.stream_extract(archive_path, "permissions", join(self.bench_dir, "extracted"))
+        with tarfile.open(archive_path, "r:gz") as tar:
+            members = tar.getmembers()
+
+        def set_member_modes():
+            for member in members:
+                member.mode = 0o775
+
+        chmod = self.timed(
+            "recursive_chmod of the extracted tree",
+            partial(routines_helpers.recursive_chmod, extracted, 0o775), file_count * file_size)
+        member_modes = self.timed("Setting mode on each member", set_member_modes, file_count * file_size)
+        self.assertLess(member_modes, chmod)
+        streamed = routines_helpers.stream_extract(archive_path, "permissions", join(self.bench_dir, "streamed"), 0o775)
+        for tree in [extracted, streamed]:
+            for root, dirs, files in walk(tree):
+                for name in dirs + files:
+                    self.assertEqual(stat.S_IMODE(lstat(join(root, name)).st_mode), 0o775)
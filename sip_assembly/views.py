@@ -1,19 +1,37 @@
+from datetime import datetime, time
 from os.path import join
 
 from asterism.views import BaseServiceView, RoutineView
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
 
 from fornax import settings
 from sip_assembly.models import SIP
-from sip_assembly.routines import (AssemblePackageRoutine,
+from sip_assembly.routines import (ArchivematicaClientMixin,
+                                   AssemblePackageRoutine,
                                    CleanupPackageRequester,
-                                   CleanupPackageRoutine,
+                                   CleanupPackageRoutine, CleanupSweepRoutine,
                                    ExtractPackageRoutine,
                                    RemoveCompletedIngestsRoutine,
                                    RemoveCompletedTransfersRoutine,
                                    RestructurePackageRoutine,
-                                   StartPackageRoutine)
-from sip_assembly.serializers import SIPListSerializer, SIPSerializer
+                                   StartPackageRoutine,
+                                   StreamAssemblePackageRoutine)
+from sip_assembly.serializers import (SIPBulkSerializer, SIPListSerializer,
+                                      SIPSerializer)
+
+
+class SIPCursorPagination(CursorPagination):
+    """Pages through SIPs by creation time, so deep pages load as quickly as the first."""
+    ordering = ('-created', '-pk')
+    page_size_query_param = 'page_size'
+    max_page_size = 500
 
 
 class SIPViewSet(ModelViewSet):
@@ -23,47 +41,156 @@ class SIPViewSet(ModelViewSet):
 
     list:
     Return paginated data about all SIPs, ordered by most recently created.
+    Accepts comma-separated `process_status` and `origin` values, and
+    `created_after` and `created_before` ISO 8601 dates, to filter SIPs.
 
     create:
     Create a new SIP.
+
+    bulk:
+    Create or update a list of SIPs.
     """
     model = SIP
-    queryset = SIP.objects.all().order_by('-created')
+    queryset = SIP.objects.all().order_by('-created', '-pk')
+    pagination_class = SIPCursorPagination
+    max_bulk_items = 1000
 
     def get_serializer_class(self):
         if self.action == 'list':
             return SIPListSerializer
         return SIPSerializer
 
-    def create(self, request):
+    def get_queryset(self):
+        """Filters SIPs in list views, without loading their data."""
+        queryset = super().get_queryset()
+        if self.action != 'list':
+            return queryset
+        params = self.request.query_params
+        if params.get('process_status'):
+            queryset = queryset.filter(process_status__in=self.get_process_statuses(params['process_status']))
+        if params.get('origin'):
+            queryset = queryset.filter(origin__in=params['origin'].split(','))
+        if params.get('created_after'):
+            queryset = queryset.filter(created__gte=self.get_datetime_param('created_after'))
+        if params.get('created_before'):
+            queryset = queryset.filter(created__lt=self.get_datetime_param('created_before'))
+        return queryset.defer('data')
+
+    def get_process_statuses(self, value):
+        try:
+            return [int(status) for status in value.split(',')]
+        except ValueError:
+            raise ValidationError({'process_status': 'Enter process statuses as comma-separated integers.'})
+
+    def get_datetime_param(self, name):
+        value = self.request.query_params[name]
+        try:
+            parsed = parse_datetime(value) or datetime.combine(parse_date(value), time.min)
+        except (TypeError, ValueError):
+            raise ValidationError({name: 'Enter a date or datetime in ISO 8601 format.'})
+        return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+    def set_sip_data(self, data):
         """Set data attributes to allow for post requests from Ursa Major 0.x or 1.x."""
-        request.data["process_status"] = SIP.CREATED
-        request.data["bag_path"] = join(
+        data["process_status"] = SIP.CREATED
+        data["bag_path"] = join(
             settings.BASE_DIR,
             settings.SRC_DIR,
             "{}.tar.gz".format(
-                request.data["identifier"]))
-        request.data["bag_identifier"] = request.data["identifier"]
-        request.data["data"] = request.data.get("bag_data")
+                data["identifier"]))
+        data["bag_identifier"] = data["identifier"]
+        data["data"] = data.get("bag_data")
+        return data
+
+    def create(self, request):
+        self.set_sip_data(request.data)
         return super().create(request)
 
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """Create or update a list of SIPs in a single query.
+
+        Each item has the same shape as a request to create a single SIP.
+        SIPs which already exist keep their process status, and only their
+        origin, data and last modified time are updated, so a list can safely
+        be sent again.
+        Returns the result for each item in the order submitted.
+        """
+        if not isinstance(request.data, list):
+            raise ValidationError('Expected a list of SIPs.')
+        if len(request.data) > self.max_bulk_items:
+            raise ValidationError('No more than {} SIPs can be created at once.'.format(self.max_bulk_items))
+        results = []
+        valid = {}
+        for item in request.data:
+            if not isinstance(item, dict) or not item.get('identifier'):
+                results.append({'identifier': None, 'status': 'invalid', 'errors': {'identifier': ['This field is required.']}})
+                continue
+            serializer = SIPBulkSerializer(data=self.set_sip_data(dict(item)))
+            if not serializer.is_valid():
+                results.append({'identifier': item['identifier'], 'status': 'invalid', 'errors': serializer.errors})
+                continue
+            result = {'identifier': item['identifier']}
+            if item['identifier'] in valid:
+                valid[item['identifier']][1].update({'status': 'skipped', 'errors': {'identifier': ['Replaced by a later item.']}})
+            valid[item['identifier']] = (SIP(**serializer.validated_data, last_modified=timezone.now()), result)
+            results.append(result)
+        with transaction.atomic():
+            existing = set(SIP.objects.filter(bag_identifier__in=list(valid)).values_list('bag_identifier', flat=True))
+            SIP.objects.bulk_create(
+                [sip for sip, _ in valid.values()],
+                batch_size=500,
+                update_conflicts=True,
+                unique_fields=['bag_identifier'],
+                update_fields=['origin', 'data', 'last_modified'])
+        for identifier, (_, result) in valid.items():
+            result['status'] = 'updated' if identifier in existing else 'created'
+        return Response({'results': results})
+
+
+class BatchRoutineView(RoutineView):
+    """Runs a routine against one or more SIPs.
+
+    Accepts optional `limit` (maximum number of SIPs to process) and
+    `max_seconds` (time after which no further SIPs are started) parameters,
+    either in the request body or as query parameters.
+    """
+
+    def get_param(self, request, name, default):
+        value = request.data.get(name, request.query_params.get(name))
+        return default if value in [None, ""] else value
+
+    def get_service_response(self, request):
+        limit = int(self.get_param(request, "limit", 1))
+        max_seconds = self.get_param(request, "max_seconds", None)
+        if limit < 1:
+            raise Exception("limit must be a positive integer")
+        return self.routine().run(
+            limit=limit,
+            max_seconds=float(max_seconds) if max_seconds is not None else None)
+
 
-class ExtractPackageView(RoutineView):
+class ExtractPackageView(BatchRoutineView):
     """Extracts compressed SIPS."""
     routine = ExtractPackageRoutine
 
 
-class RestructurePackageView(RoutineView):
+class RestructurePackageView(BatchRoutineView):
     """Restructures SIPS."""
     routine = RestructurePackageRoutine
 
 
-class AssemblePackageView(RoutineView):
+class AssemblePackageView(BatchRoutineView):
     """Packages SIPs."""
     routine = AssemblePackageRoutine
 
 
-class StartPackageView(RoutineView):
+class StreamAssemblePackageView(BatchRoutineView):
+    """Restructures and packages SIPs without extracting them."""
+    routine = StreamAssemblePackageRoutine
+
+
+class StartPackageView(BatchRoutineView):
     """Approves transfers in Archivematica. Accepts POST requests only."""
     routine = StartPackageRoutine
 
@@ -78,14 +205,32 @@ class RemoveCompletedIngestsView(RoutineView):
     routine = RemoveCompletedIngestsRoutine
 
 
-class CleanupPackageRequestView(RoutineView):
+class CleanupPackageRequestView(BatchRoutineView):
     """Sends request to previous microservice to clean up source directory."""
     routine = CleanupPackageRequester
 
 
 class CleanupPackageRoutineView(BaseServiceView):
-    """Removes a transfer from the destination directory. Accepts POST requests only."""
+    """Removes a transfer, or a list of `identifiers`, from the destination directory. Accepts POST requests only."""
 
     def get_service_response(self, request):
-        identifier = request.data.get('identifier')
+        identifier = request.data.get('identifiers', request.data.get('identifier'))
         return CleanupPackageRoutine(identifier).run()
+
+
+class CleanupSweepView(BaseServiceView):
+    """Removes transfers for SIPs which have finished processing from the destination directory. Accepts POST requests only."""
+
+    def get_service_response(self, request):
+        return CleanupSweepRoutine(
+            min_status=request.data.get('min_status'),
+            min_age=request.data.get('min_age'),
+            dry_run=bool(request.data.get('dry_run'))).run()
+
+
+class ProcessingConfigCacheView(BaseServiceView):
+    """Clears cached processing configurations for an origin, or for all origins. Accepts POST requests only."""
+
+    def get_service_response(self, request):
+        origin = request.data.get('origin')
+        return ArchivematicaClientMixin().invalidate_processing_configs(origin)